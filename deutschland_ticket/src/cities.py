@@ -1,16 +1,34 @@
-import queue
 import re
 import sqlite3
-from typing import Dict, List
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 import requests
 from langchain.chat_models import ChatOpenAI
 
-from src.common import city_table_connection
+from src.common import (
+    TokenBucket,
+    call_with_retry,
+    city_table_connection,
+    session_with_retry,
+)
 from src.langchain_summarize import _get_llm, gpt_summary
-from src.model import WikiCategoryResponse, WikiPageResponse
+from src.model import Page, WikiCategoryResponse, WikiPageResponse
+from src.summary_cache import SummaryCache
 
 _WIKIVOYAGE_URL = "https://en.wikivoyage.org/w/api.php"
+# Most titles the API accepts in one request
+_TITLES_PER_REQUEST = 50
+# Seconds to wait for the API to answer a request
+_TIMEOUT = 30
+# LLM calls in flight, how often they may start and rows per transaction
+_SUMMARY_WORKERS = 8
+_SUMMARIES_PER_MINUTE = 60
+_WRITE_BATCH_SIZE = 20
+
+# (page text, city) -> city description
+Summarizer = Callable[[str, str], str]
 
 
 def _category_query_params(category: str) -> Dict:
@@ -23,14 +41,16 @@ def _category_query_params(category: str) -> Dict:
     }
 
 
-def _page_query_params(page_title: str) -> Dict:
+def _page_query_params(page_titles: List[str]) -> Dict:
     return {
         "action": "query",
         "format": "json",
-        "titles": page_title,
-        "prop": "extracts",
-        "explaintext": True,
-        "inprop": "url",
+        "titles": "|".join(page_titles),
+        # TextExtracts returns a single whole-page extract per request, the
+        # latest revision's wikitext comes for every title in the batch
+        "prop": "revisions",
+        "rvprop": "content",
+        "rvslots": "main",
     }
 
 
@@ -38,63 +58,149 @@ def _create_url_from_page_id(page_id: int) -> str:
     return f"https://en.wikivoyage.org/?curid={page_id}"
 
 
-def parse_category_page() -> List[str]:
+def _category_members(
+    session: requests.Session, category: str, api_url: str = _WIKIVOYAGE_URL
+) -> Tuple[List[str], List[str]]:
     """
-    Create a queue that goes down all subcategories of the Germany category
-    Process the queue to get all pages within all subcategories
+    Subcategories and pages of a category. Follows the continue block
+    of the response, as a single request returns at most cmlimit members
     """
-    categories = queue.Queue()  # type: ignore
-    categories.put("Category:Germany")
-
-    pages = []
-
-    category_counter: int = 0
-    while not categories.empty():
-        category = categories.get()
+    subcategories: List[str] = []
+    pages: List[str] = []
 
-        response = requests.get(_WIKIVOYAGE_URL, params=_category_query_params(category))  # type: ignore
+    params = _category_query_params(category)
+    while True:
+        response = session.get(api_url, params=params, timeout=_TIMEOUT)
+        response.raise_for_status()
         response_data = WikiCategoryResponse.parse_obj(response.json())
         for member in response_data.query.categorymembers:
             if member.ns == 14:
-                categories.put(member.title)
+                subcategories.append(member.title)
             if member.ns == 0:
                 pages.append(member.title)
 
-        category_counter += 1
-        print(f"Processed {category_counter} categories")
+        if response_data.continue_ is None:
+            return subcategories, pages
+        params = {**_category_query_params(category), **response_data.continue_}
+
+
+def parse_category_page(
+    root: str = "Category:Germany",
+    max_workers: int = 8,
+    session: Optional[requests.Session] = None,
+    api_url: str = _WIKIVOYAGE_URL,
+) -> List[str]:
+    """
+    Walk down all subcategories of the root category with a pool of
+    max_workers threads sharing one session, and collect the pages within
+    them. Categories reachable by several paths, or by a cycle, are only
+    fetched once, and every page is only listed once
+    """
+    session = session or session_with_retry(pool_size=max_workers)
+
+    visited = {root}
+    pages: Dict[str, None] = {}
+    category_counter: int = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_category_members, session, root, api_url)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subcategories, category_pages = future.result()
+                pages.update(dict.fromkeys(category_pages))
+                for category in subcategories:
+                    if category not in visited:
+                        visited.add(category)
+                        pending.add(
+                            executor.submit(
+                                _category_members, session, category, api_url
+                            )
+                        )
+
+                category_counter += 1
+                print(f"Processed {category_counter} categories")
 
-    return pages
+    return list(pages)
 
 
-def _insert_city_description_in_table(
-    llm: ChatOpenAI, cursor: sqlite3.Cursor, city: str, table_name: str
+def fetch_city_pages(
+    page_titles: List[str],
+    session: Optional[requests.Session] = None,
+    api_url: str = _WIKIVOYAGE_URL,
+    batch_size: int = _TITLES_PER_REQUEST,
+) -> Iterator[Page]:
+    """
+    Fetch the wikitext of the pages batch_size titles per request, and
+    yield every page as soon as its content has arrived. The API returns
+    fewer revisions than titles when they do not fit in one response, the
+    rest follow in continued requests for the same batch
+    """
+    session = session or session_with_retry()
+
+    for start in range(0, len(page_titles), batch_size):
+        end = start + batch_size
+        batch = page_titles[start:end]
+        params = _page_query_params(batch)
+        while True:
+            response = session.get(api_url, params=params, timeout=_TIMEOUT)
+            response.raise_for_status()
+            page_content = WikiPageResponse.parse_obj(response.json())
+            for page_info in page_content.query.pages.values():
+                if page_info.pageid is not None and page_info.content is not None:
+                    yield page_info
+
+            if page_content.continue_ is None:
+                break
+            params = {**_page_query_params(batch), **page_content.continue_}
+
+
+def _is_city(page_info: Page) -> bool:
+    return not re.search("== Regions ==", page_info.plain_text or "")
+
+
+def _city_description_row(
+    summarize: Summarizer, rate_limiter: TokenBucket, page_info: Page
+) -> Tuple[str, str, str]:
+    """
+    Runs in a summary worker: the (city, description, url) row of a page
+    """
+    city = page_info.title
+
+    def rate_limited_summary() -> str:
+        rate_limiter.acquire()
+        return summarize(page_info.plain_text or "", city)
+
+    print(f"Getting city summary for {city}.")
+    city_description = call_with_retry(rate_limited_summary)
+    return city, city_description, _create_url_from_page_id(page_info.pageid)  # type: ignore
+
+
+def _insert_city_descriptions(
+    conn: sqlite3.Connection, table_name: str, rows: List[Tuple[str, str, str]]
 ) -> None:
-    content_response = requests.get(_WIKIVOYAGE_URL, params=_page_query_params(city))
-    page_content = WikiPageResponse.parse_obj(content_response.json())
-
-    # Extract the page content
-    for _, page_info in page_content.query.pages.items():
-        city = page_info.title
-        page_extract = page_info.extract
-
-        is_city = not re.search("== Regions ==", page_extract)
-        if is_city:
-            cursor.execute(f"SELECT city FROM {table_name} WHERE city='{city}'")
-            is_city_not_present = cursor.fetchone() is None
-
-            if is_city_not_present:
-                print(f"Getting city summary for {city}.")
-                city_description = gpt_summary(llm, page_extract, city)
-
-                print(f"Writing info for {city} city.")
-                cursor.execute(
-                    f"INSERT INTO {table_name} (city, description, url) VALUES (?, ?, ?)",
-                    (
-                        city,
-                        city_description,
-                        _create_url_from_page_id(page_info.pageid),
-                    ),
-                )
+    # One transaction for the whole batch
+    with conn:
+        conn.executemany(
+            f"""
+            INSERT INTO {table_name} (city, description, url) VALUES (?, ?, ?)
+            ON CONFLICT (city) DO NOTHING
+            """,
+            rows,
+        )
+    print(f"Wrote info for {len(rows)} cities.")
+    rows.clear()
+
+
+def _insert_skipped_titles(
+    conn: sqlite3.Connection, table_name: str, titles: List[str]
+) -> None:
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {table_name}_skipped (title) VALUES (?) "
+            "ON CONFLICT (title) DO NOTHING",
+            [(title,) for title in titles],
+        )
+    titles.clear()
 
 
 def cities_table(
@@ -102,12 +208,27 @@ def cities_table(
     page_titles: List[str],
     conn: sqlite3.Connection,
     table_name: str,
+    summarize: Optional[Summarizer] = None,
+    max_workers: int = _SUMMARY_WORKERS,
+    summaries_per_minute: float = _SUMMARIES_PER_MINUTE,
+    batch_size: int = _WRITE_BATCH_SIZE,
 ) -> None:
     """
     We want city description. To start with we were doing
     crude regex which was not very good. Then we tried using
     Pythia but summaries were pretty bad. So finally, we moved
     over to ChatGPT
+
+    The table is built incrementally. Cities already in it, and pages
+    found not to be cities, kept in {table_name}_skipped, are skipped
+    before their page is fetched, so a run that was interrupted picks up
+    where it stopped
+
+    Up to max_workers summaries run at once, started at no more than
+    summaries_per_minute, and failed ones are retried with backoff. This
+    thread is the only one writing to conn, batch_size rows per
+    transaction. summarize defaults to gpt_summary with llm, pass another
+    (page_extract, city) -> description function to use a different model
     """
 
     conn.execute(
@@ -119,21 +240,80 @@ def cities_table(
         )
     """
     )
+    conn.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_city ON {table_name}(city)"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {table_name}_skipped(title TEXT PRIMARY KEY)"
+    )
 
-    cursor = conn.cursor()
+    existing_cities = {city for city, in conn.execute(f"SELECT city FROM {table_name}")}
+    skipped_titles = {
+        title for title, in conn.execute(f"SELECT title FROM {table_name}_skipped")
+    }
+    missing_titles = [
+        title
+        for title in page_titles
+        if title not in existing_cities and title not in skipped_titles
+    ]
+    print(
+        f"{len(page_titles) - len(missing_titles)} pages already in {table_name} "
+        f"or skipped, fetching {len(missing_titles)} pages."
+    )
+
+    summarize = summarize or partial(gpt_summary, llm)
+    rate_limiter = TokenBucket(summaries_per_minute / 60, capacity=max_workers)
 
-    for city in page_titles:
-        _insert_city_description_in_table(llm, cursor, city, table_name)
-        conn.commit()
+    rows: List[Tuple[str, str, str]] = []
+    non_city_titles: List[str] = []
+    pending: Set[Future] = set()
 
-    conn.close()
+    def collect(futures: Set[Future]) -> None:
+        # Rows of the successful summaries first, then raise any failure
+        rows.extend(f.result() for f in futures if f.exception() is None)
+        if len(rows) >= batch_size:
+            _insert_city_descriptions(conn, table_name, rows)
+        for future in futures:
+            future.result()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for page_info in fetch_city_pages(missing_titles):
+                # The API may return a normalised title that is already summarised
+                if page_info.title in existing_cities:
+                    continue
+                if not _is_city(page_info):
+                    non_city_titles.append(page_info.title)
+                    continue
+                existing_cities.add(page_info.title)
+                pending.add(
+                    executor.submit(
+                        _city_description_row, summarize, rate_limiter, page_info
+                    )
+                )
+                # Keep fetching only a little ahead of the summaries
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            done, pending = wait(pending)
+            collect(done)
+    finally:
+        # Keep the summaries done so far when one of them failed, the
+        # executor has waited for those still in flight
+        rows.extend(f.result() for f in pending if f.exception() is None)
+        if rows:
+            _insert_city_descriptions(conn, table_name, rows)
+        if non_city_titles:
+            _insert_skipped_titles(conn, table_name, non_city_titles)
+        conn.close()
 
 
 if __name__ == "__main__":
     # Get all pages under the category Germany
     pages = parse_category_page()
 
-    # Add city descriptions using ChatGPT
+    # Add city descriptions using ChatGPT, through the summary cache
     llm = _get_llm()
     conn = city_table_connection()
-    cities_table(llm, pages, conn, table_name="cities")
+    summarize = partial(gpt_summary, llm, cache=SummaryCache())
+    cities_table(llm, pages, conn, table_name="cities", summarize=summarize)
@@ -1,11 +1,16 @@
+import random
 import sqlite3
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional, Tuple, Type, TypeVar
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+T = TypeVar("T")
+
 
 def city_table_connection(table_name: Optional[str] = None) -> sqlite3.Connection:
     db_path = Path(".").resolve() / "data" / "cities.sqlite"
@@ -20,7 +25,11 @@ def city_table_connection(table_name: Optional[str] = None) -> sqlite3.Connectio
     return conn
 
 
-def session_with_retry() -> requests.Session:
+def session_with_retry(pool_size: int = 10) -> requests.Session:
+    """
+    pool_size is the number of connections kept open per host, set it to
+    the number of threads sharing the session
+    """
     session = requests.Session()
 
     retries = 3
@@ -33,8 +42,58 @@ def session_with_retry() -> requests.Session:
         backoff_factor=backoff_factor,
     )
 
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
     return session
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, in bursts of up to capacity
+    calls. acquire blocks until a token is free and can be shared by threads
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def call_with_retry(
+    func: Callable[[], T],
+    retries: int = 3,
+    backoff_factor: float = 1.0,
+    retry_on: Tuple[Type[Exception], ...] = (Exception,),
+) -> T:
+    """
+    Call func, and on failure again up to retries times, waiting an
+    exponentially growing, jittered backoff in between
+    """
+    for attempt in range(retries):
+        try:
+            return func()
+        except retry_on as error:
+            wait_time = backoff_factor * 2**attempt * random.uniform(0.5, 1.5)
+            print(f"Retrying in {wait_time:.1f}s after error: {error}")
+            time.sleep(wait_time)
+    return func()
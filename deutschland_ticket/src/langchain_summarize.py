@@ -1,14 +1,20 @@
+import json
 import os
 import time
+from functools import partial
+from typing import List, Optional, cast
 
 from dotenv import load_dotenv
 from langchain import PromptTemplate
-from langchain.chains.summarize import load_summarize_chain
+from langchain.chains.combine_documents.map_reduce import MapReduceDocumentsChain
+from langchain.chains.summarize import load_summarize_chain, map_reduce_prompt
 from langchain.chat_models import ChatOpenAI
 from langchain.docstore.document import Document
 from langchain.text_splitter import CharacterTextSplitter
 from text_generation import InferenceAPIClient
 
+from src.summary_cache import SummaryCache
+
 
 def get_client() -> InferenceAPIClient:
     load_dotenv()
@@ -141,7 +147,44 @@ def summary(client: InferenceAPIClient, city_text: str, city: str) -> str:
     return _summary_of_summary(client, total_summary, city)
 
 
-def gpt_summary(llm: ChatOpenAI, city_text: str, city: str) -> str:
+def _cached_map_reduce(
+    chain: MapReduceDocumentsChain,
+    docs: List[Document],
+    model: str,
+    map_prompt: PromptTemplate,
+    combine_prompt: PromptTemplate,
+    cache: SummaryCache,
+) -> str:
+    """
+    Same as chain.run(docs), with the summary of every chunk and the
+    combined summary looked up in the cache first
+    """
+    chunk_summaries = [
+        cache.cached(
+            model,
+            map_prompt.template,
+            doc.page_content,
+            partial(chain.llm_chain.predict, text=doc.page_content),
+        )
+        for doc in docs
+    ]
+
+    def combine() -> str:
+        # The reduce half of MapReduceDocumentsChain.combine_docs, which
+        # collapses the chunk summaries first when they are too long. It is
+        # private, so langchain is pinned to the version it was checked on
+        results = [{chain.llm_chain.output_key: summary} for summary in chunk_summaries]
+        combined_summary, _ = chain._process_results(results, docs)
+        return combined_summary
+
+    return cache.cached(
+        model, combine_prompt.template, json.dumps(chunk_summaries), combine
+    )
+
+
+def gpt_summary(
+    llm: ChatOpenAI, city_text: str, city: str, cache: Optional[SummaryCache] = None
+) -> str:
     city_string = f"Combine all the summaries on {city} provided within backticks "
     combine_prompt = PromptTemplate(
         template=(
@@ -152,6 +195,7 @@ def gpt_summary(llm: ChatOpenAI, city_text: str, city: str) -> str:
         ),
         input_variables=["text"],
     )
+    map_prompt = map_reduce_prompt.PROMPT
 
     text_splitter = CharacterTextSplitter()
     texts = text_splitter.split_text(city_text)
@@ -159,9 +203,21 @@ def gpt_summary(llm: ChatOpenAI, city_text: str, city: str) -> str:
     docs = [Document(page_content=t) for t in texts]
 
     chain = load_summarize_chain(
-        llm, chain_type="map_reduce", combine_prompt=combine_prompt
+        llm,
+        chain_type="map_reduce",
+        map_prompt=map_prompt,
+        combine_prompt=combine_prompt,
+    )
+    if cache is None:
+        return chain.run(docs)
+    return _cached_map_reduce(
+        cast(MapReduceDocumentsChain, chain),
+        docs,
+        llm.model_name,
+        map_prompt,
+        combine_prompt,
+        cache,
     )
-    return chain.run(docs)
 
 
 # ToDo
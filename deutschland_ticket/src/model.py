@@ -1,7 +1,15 @@
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
-from pydantic import BaseModel, validator
+import mwparserfromhell
+from mwparserfromhell.nodes import Heading, Node, Tag, Template, Text, Wikilink
+from mwparserfromhell.wikicode import Wikicode
+from pydantic import BaseModel, Field, validator
+
+# Wikivoyage templates for a place to see, eat, sleep etc. with a name and
+# a description, which TextExtracts rendered as text
+_LISTING_TEMPLATES = {"listing", "see", "do", "buy", "eat", "drink", "sleep", "go"}
+_NON_TEXT_LINKS = ("file:", "image:", "category:")
 
 
 class Location(BaseModel):
@@ -209,14 +217,77 @@ class WikiQuery(BaseModel):
 
 
 class WikiCategoryResponse(BaseModel):
-    batchcomplete: str
+    # Responses cut short by cmlimit have no batchcomplete, and a continue
+    # block whose parameters are sent with the next request
+    batchcomplete: Optional[str]
+    continue_: Optional[Dict[str, str]] = Field(None, alias="continue")
     query: WikiQuery
 
 
+def _listing_text(template: Template) -> str:
+    parts = [
+        mwparserfromhell.parse(template.get(param).value).strip_code().strip()
+        for param in ("name", "content")
+        if template.has(param)
+    ]
+    return ": ".join(part for part in parts if part)
+
+
+def wikitext_to_plain_text(wikitext: str) -> str:
+    """
+    Plain text of a Wikivoyage page in the shape of a TextExtracts
+    explaintext extract: headings as "== Regions ==", listings as their
+    name and description, and no other templates, files, categories or
+    references
+    """
+    nodes: List[Node] = []
+    for node in mwparserfromhell.parse(wikitext).nodes:
+        if isinstance(node, Heading):
+            marks = "=" * node.level
+            nodes.append(Text(f"{marks} {node.title.strip_code().strip()} {marks}"))
+        elif isinstance(node, Template):
+            if node.name.strip().lower() in _LISTING_TEMPLATES:
+                nodes.append(Text(_listing_text(node)))
+        elif isinstance(node, Wikilink):
+            if not str(node.title).strip().lower().startswith(_NON_TEXT_LINKS):
+                nodes.append(node)
+        elif not (isinstance(node, Tag) and node.tag == "ref"):
+            nodes.append(node)
+    return str(Wikicode(nodes).strip_code()).strip()
+
+
+class RevisionSlot(BaseModel):
+    content: str = Field(alias="*")
+
+
+class Revision(BaseModel):
+    slots: Dict[str, RevisionSlot]
+
+
 class Page(BaseModel):
-    pageid: int
+    # Titles without a page have no pageid, and pages whose revision comes
+    # in a later continued response have no revisions yet
+    pageid: Optional[int]
     title: str
-    extract: str
+    revisions: Optional[List[Revision]]
+
+    @property
+    def content(self) -> Optional[str]:
+        """
+        Wikitext of the latest revision's main slot
+        """
+        if not self.revisions:
+            return None
+        return self.revisions[0].slots["main"].content
+
+    @property
+    def plain_text(self) -> Optional[str]:
+        """
+        content as plain text, which is what gets summarised
+        """
+        if self.content is None:
+            return None
+        return wikitext_to_plain_text(self.content)
 
 
 class WikiPageQuery(BaseModel):
@@ -224,7 +295,8 @@ class WikiPageQuery(BaseModel):
 
 
 class WikiPageResponse(BaseModel):
-    batchcomplete: str
+    batchcomplete: Optional[str]
+    continue_: Optional[Dict[str, str]] = Field(None, alias="continue")
     query: WikiPageQuery
 
 
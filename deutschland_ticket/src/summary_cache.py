@@ -0,0 +1,167 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+_CACHE_PATH = Path(".").resolve() / "data" / "summary_cache.sqlite"
+# Total size of the cached summaries before the least recently used go
+_MAX_BYTES = 64 * 2**20
+
+
+def summary_key(model: str, prompt_template: str, text: str) -> str:
+    """
+    Content address of an LLM output. Changing the model, the prompt
+    template or the text gives a new key, anything else reuses the output
+    """
+    return hashlib.sha256(
+        json.dumps([model, prompt_template, text]).encode()
+    ).hexdigest()
+
+
+class SummaryCache:
+    """
+    LLM outputs in SQLite, looked up by summary_key. Once the stored
+    outputs are larger than max_bytes, the least recently used ones are
+    evicted. Safe to share between the threads of the summary pool
+    and with other processes using the same file
+    """
+
+    def __init__(self, path: Path = _CACHE_PATH, max_bytes: int = _MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # One lock per key being summarised, so threads asking for the same
+        # summary make a single LLM call
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summary_cache(
+                key TEXT PRIMARY KEY,
+                summary TEXT,
+                size INTEGER,
+                last_used REAL
+            )
+        """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS summary_cache_last_used "
+            "ON summary_cache(last_used)"
+        )
+        # Total size of the stored summaries, kept by triggers in the same
+        # transaction as every write, whichever process or instance makes it
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summary_cache_size(
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER
+            )
+        """
+        )
+        self._conn.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS summary_cache_insert
+            AFTER INSERT ON summary_cache BEGIN
+                UPDATE summary_cache_size SET total = total + new.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS summary_cache_update
+            AFTER UPDATE OF size ON summary_cache BEGIN
+                UPDATE summary_cache_size SET total = total + new.size - old.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS summary_cache_delete
+            AFTER DELETE ON summary_cache BEGIN
+                UPDATE summary_cache_size SET total = total - old.size;
+            END;
+        """
+        )
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT OR IGNORE INTO summary_cache_size (id, total)
+                SELECT 0, COALESCE(SUM(size), 0) FROM summary_cache
+                """
+            )
+
+    def _total_bytes(self) -> int:
+        (total,) = self._conn.execute(
+            "SELECT total FROM summary_cache_size WHERE id = 0"
+        ).fetchone()
+        return int(total)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT summary FROM summary_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE summary_cache SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            summary: str = row[0]
+            return summary
+
+    def set(self, key: str, summary: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO summary_cache (key, summary, size, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    summary = excluded.summary,
+                    size = excluded.size,
+                    last_used = excluded.last_used
+                """,
+                (key, summary, len(summary.encode()), time.time()),
+            )
+
+            # Evict the least recently used summaries until the rest fit. The
+            # insert holds the write lock, so no other process changes the
+            # table until the transaction ends
+            while self._total_bytes() > self.max_bytes:
+                cursor = self._conn.execute(
+                    """
+                    DELETE FROM summary_cache WHERE key = (
+                        SELECT key FROM summary_cache ORDER BY last_used, key LIMIT 1
+                    )
+                    """
+                )
+                if cursor.rowcount == 0:
+                    break
+
+    def cached(
+        self,
+        model: str,
+        prompt_template: str,
+        text: str,
+        summarize: Callable[[], str],
+    ) -> str:
+        """
+        The cached output for (model, prompt_template, text), calling
+        summarize and storing its result on a miss
+        """
+        key = summary_key(model, prompt_template, text)
+        summary = self.get(key)
+        if summary is not None:
+            return summary
+
+        with self._key_locks_lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # Another thread may have stored it while this one waited
+                summary = self.get(key)
+                if summary is None:
+                    summary = summarize()
+                    self.set(key, summary)
+        finally:
+            with self._key_locks_lock:
+                self._key_locks.pop(key, None)
+        return summary
+
+    def close(self) -> None:
+        self._conn.close()
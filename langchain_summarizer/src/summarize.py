@@ -1,5 +1,7 @@
+import json
 import os
-from typing import Dict
+from functools import partial
+from typing import Dict, List, Optional, cast
 
 import requests
 from dotenv import load_dotenv
@@ -8,11 +10,14 @@ from langchain.text_splitter import CharacterTextSplitter
 from text_generation import InferenceAPIClient
 from langchain.chat_models import ChatOpenAI
 from langchain import PromptTemplate
-from langchain.chains.summarize import load_summarize_chain
+from langchain.chains.combine_documents.map_reduce import MapReduceDocumentsChain
+from langchain.chains.summarize import load_summarize_chain, map_reduce_prompt
 
 from src.model import WikiPageResponse
+from src.summary_cache import SummaryCache
 
 _WIKIVOYAGE_URL = "https://en.wikivoyage.org/w/api.php"
+_HF_MODEL = "OpenAssistant/oasst-sft-4-pythia-12b-epoch-3.5"
 
 
 def _page_query_params(page_title: str) -> Dict:
@@ -34,8 +39,7 @@ def _get_wiki_page(city: str) -> str:
 
 def _get_client() -> InferenceAPIClient:
     load_dotenv()
-    model = "OpenAssistant/oasst-sft-4-pythia-12b-epoch-3.5"
-    return InferenceAPIClient(model, token=os.getenv("HF_TOKEN", None))
+    return InferenceAPIClient(_HF_MODEL, token=os.getenv("HF_TOKEN", None))
 
 
 def predict(client: InferenceAPIClient, input: str) -> str:
@@ -76,14 +80,35 @@ def predict(client: InferenceAPIClient, input: str) -> str:
     return "".join([text.strip() for text in chat])
 
 
-def summary(client: InferenceAPIClient, city_text: str, city: str) -> str:
+def _cached_predict(
+    client: InferenceAPIClient,
+    prompt_template: str,
+    text: str,
+    cache: Optional[SummaryCache],
+) -> str:
+    prompt = prompt_template.format(text=text)
+    if cache is None:
+        return predict(client, prompt)
+    return cache.cached(
+        _HF_MODEL, prompt_template, text, partial(predict, client, prompt)
+    )
+
+
+def summary(
+    client: InferenceAPIClient,
+    city_text: str,
+    city: str,
+    cache: Optional[SummaryCache] = None,
+) -> str:
     text_splitter = CharacterTextSplitter(chunk_size=512)
 
     texts = text_splitter.split_text(city_text)
 
     docs = [Document(page_content=t) for t in texts]
     text_summary = [
-        predict(client, f"Summarize the following text.\n{doc.page_content}")
+        _cached_predict(
+            client, "Summarize the following text.\n{text}", doc.page_content, cache
+        )
         for doc in docs
     ]
 
@@ -91,13 +116,47 @@ def summary(client: InferenceAPIClient, city_text: str, city: str) -> str:
 
     summary_prompt = (
         f"Combine all the summaries on {city} provided within backticks"
-        f"""```{total_summary}```.
+        """```{text}```.
             Can you summarize it as a tourist destination in 8-10 sentences.\n"""
     )
-    return predict(client, f"{summary_prompt}\n{total_summary}")
+    return _cached_predict(client, f"{summary_prompt}\n{{text}}", total_summary, cache)
+
+
+def _cached_map_reduce(
+    chain: MapReduceDocumentsChain,
+    docs: List[Document],
+    model: str,
+    map_prompt: PromptTemplate,
+    combine_prompt: PromptTemplate,
+    cache: SummaryCache,
+) -> str:
+    """
+    chain.run(docs) with every LLM call going through the cache
+    """
+    chunk_summaries = [
+        cache.cached(
+            model,
+            map_prompt.template,
+            doc.page_content,
+            partial(chain.llm_chain.predict, text=doc.page_content),
+        )
+        for doc in docs
+    ]
+
+    def combine() -> str:
+        # The reduce half of MapReduceDocumentsChain.combine_docs, which
+        # collapses the chunk summaries first when they are too long. It is
+        # private, so langchain is pinned to the version it was checked on
+        results = [{chain.llm_chain.output_key: summary} for summary in chunk_summaries]
+        combined_summary, _ = chain._process_results(results, docs)
+        return combined_summary
+
+    return cache.cached(
+        model, combine_prompt.template, json.dumps(chunk_summaries), combine
+    )
 
 
-def gpt_summary(city_text: str, city: str) -> str:
+def gpt_summary(city_text: str, city: str, cache: Optional[SummaryCache] = None) -> str:
     load_dotenv()
     # Base model uses is gpt3.5-turbo
     llm = ChatOpenAI(temperature=0)  # type: ignore
@@ -112,6 +171,7 @@ def gpt_summary(city_text: str, city: str) -> str:
         ),
         input_variables=["text"],
     )
+    map_prompt = map_reduce_prompt.PROMPT
 
     text_splitter = CharacterTextSplitter()
     texts = text_splitter.split_text(city_text)
@@ -119,18 +179,33 @@ def gpt_summary(city_text: str, city: str) -> str:
     docs = [Document(page_content=t) for t in texts]
 
     chain = load_summarize_chain(
-        llm, chain_type="map_reduce", combine_prompt=combine_prompt
+        llm,
+        chain_type="map_reduce",
+        map_prompt=map_prompt,
+        combine_prompt=combine_prompt,
+    )
+    if cache is None:
+        return chain.run(docs)
+    return _cached_map_reduce(
+        cast(MapReduceDocumentsChain, chain),
+        docs,
+        llm.model_name,
+        map_prompt,
+        combine_prompt,
+        cache,
     )
-    return chain.run(docs)
 
 
 if __name__ == "__main__":
     city = "Allgäu"
     wiki_text = _get_wiki_page(city)
 
+    # Summaries of unchanged chunks and pages are reused across runs
+    cache = SummaryCache()
+
     client = _get_client()
-    page_summary = summary(client, wiki_text, city)
+    page_summary = summary(client, wiki_text, city, cache)
     print(page_summary)
 
-    gpt_page_summary = gpt_summary(wiki_text, city)
+    gpt_page_summary = gpt_summary(wiki_text, city, cache)
     print(gpt_page_summary)
@@ -0,0 +1,229 @@
+"""
+Benchmark suite for the groupby-interpolate engines in groupby_profile.
+
+Every case runs in a fresh process, so peak RSS belongs to that case alone.
+Results are written as JSON, and with --baseline the run fails when a case
+got slower than the stored baseline by more than --tolerance.
+
+    python benchmark.py --rows 1e3 1e5 1e7 --engines numpy numba polars
+    python benchmark.py --output current.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from data_generator import generate_dataframe
+from group_index import indexed_groupby
+from groupby_profile import (
+    _INTERPOLATE_AT,
+    _YEARS,
+    numpy_ragged_groupby,
+    pandas_groupby,
+    polars_expr_groupby,
+    polars_groupby,
+    ragged_groupby,
+)
+
+try:
+    from pyspark.sql import SparkSession
+except ImportError:  # Spark is only benchmarked where it is installed
+    SparkSession = None  # type: ignore
+
+_ROWS = [10**3, 10**4, 10**5, 10**6, 10**7, 10**8]
+_GROUPS = [33, 10**4]
+_GROUP_SIZES = ["uniform", "skewed"]
+_SKEW = {"uniform": 0.0, "skewed": 1.5}
+_DTYPES = ["float64", "float32"]
+_REPEAT = 5
+# Engines that interpolate group by group in Python are skipped above these
+# sizes, unless --no-row-caps is given
+_MAX_ROWS = {"pandas": 10**7, "polars": 10**7, "spark": 10**7}
+_TOLERANCE = 0.1
+
+
+@dataclass(frozen=True)
+class BenchmarkCase:
+    engine: str
+    num_rows: int
+    num_groups: int
+    group_sizes: str
+    dtype: str
+
+
+def _spark_interpolate(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_values("x")
+    return pd.DataFrame(
+        data={
+            "category": df["category"].iloc[:1],
+            "year": df["year"].iloc[:1],
+            "y": [np.interp(_INTERPOLATE_AT, df["x"], df["y"])],
+        }
+    )
+
+
+def _spark_groupby(spark_df: Any) -> pd.DataFrame:
+    return (
+        spark_df.groupBy("category", "year")
+        .applyInPandas(_spark_interpolate, schema="category long, year long, y double")
+        .toPandas()
+    )
+
+
+def _spark_input(df: pd.DataFrame) -> Any:
+    spark_session = SparkSession.builder.master("local[*]").getOrCreate()
+    spark_df = spark_session.createDataFrame(df).cache()
+    spark_df.count()
+    return spark_df
+
+
+# Each engine with the conversion of its input, which is not timed
+_ENGINES: Dict[str, Callable[[Any], Any]] = {
+    "pandas": pandas_groupby,
+    "numpy": numpy_ragged_groupby,
+    "numba": ragged_groupby,
+    "numba_parallel": partial(ragged_groupby, parallel=True),
+    # Every timed call after the first reuses the cached sort
+    "indexed": indexed_groupby,
+    "polars": polars_groupby,
+    "polars_expr": polars_expr_groupby,
+}
+_ENGINE_INPUTS: Dict[str, Callable[[pd.DataFrame], Any]] = {
+    "polars": pl.from_pandas,
+    "polars_expr": pl.from_pandas,
+}
+if SparkSession is not None:
+    _ENGINES["spark"] = _spark_groupby
+    _ENGINE_INPUTS["spark"] = _spark_input
+
+
+def _benchmark_frame(
+    num_rows: int, num_groups: int, group_sizes: str, dtype: str
+) -> pd.DataFrame:
+    return generate_dataframe(
+        num_rows,
+        num_categories=-(-num_groups // len(_YEARS)),
+        num_years=len(_YEARS),
+        skew=_SKEW[group_sizes],
+        dtype=dtype,
+    )
+
+
+def _run_case(case: BenchmarkCase, repeat: int) -> Dict[str, Any]:
+    df = _benchmark_frame(case.num_rows, case.num_groups, case.group_sizes, case.dtype)
+    engine_input = _ENGINE_INPUTS.get(case.engine, lambda df: df)(df)
+    groupby = _ENGINES[case.engine]
+
+    # The first call pays for JIT compilation and is not timed
+    groupby(engine_input)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        groupby(engine_input)
+        timings.append(time.perf_counter() - start)
+
+    median_seconds = float(np.median(timings))
+    return {
+        **asdict(case),
+        "median_seconds": median_seconds,
+        "p95_seconds": float(np.percentile(timings, 95)),
+        "rows_per_second": case.num_rows / median_seconds,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_benchmarks(cases: List[BenchmarkCase], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(_run_case, (case, repeat))
+        print(
+            f"{case.engine:>14} rows={case.num_rows:<11,} groups={case.num_groups:<7,} "
+            f"{case.group_sizes:>7} {case.dtype}: median {result['median_seconds']:.4f}s "
+            f"p95 {result['p95_seconds']:.4f}s {result['rows_per_second']:,.0f} rows/s "
+            f"peak RSS {result['peak_rss_mb']:,.0f} MB"
+        )
+        results.append(result)
+    return results
+
+
+def _case_key(result: Dict[str, Any]) -> tuple:
+    return tuple(result[field] for field in BenchmarkCase.__dataclass_fields__)
+
+
+def find_regressions(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    baseline_by_case = {_case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_by_case.get(_case_key(result))
+        if baseline_result is None:
+            continue
+
+        slowdown = result["median_seconds"] / baseline_result["median_seconds"] - 1
+        if slowdown > tolerance:
+            regressions.append(
+                f"{BenchmarkCase(*_case_key(result))} is {slowdown:.0%} slower "
+                f"({baseline_result['median_seconds']:.4f}s -> {result['median_seconds']:.4f}s)"
+            )
+    return regressions
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", nargs="+", type=float, default=_ROWS)
+    parser.add_argument("--groups", nargs="+", type=int, default=_GROUPS)
+    parser.add_argument(
+        "--group-sizes", nargs="+", default=_GROUP_SIZES, choices=_GROUP_SIZES
+    )
+    parser.add_argument("--dtypes", nargs="+", default=_DTYPES, choices=_DTYPES)
+    parser.add_argument(
+        "--engines", nargs="+", default=list(_ENGINES), choices=list(_ENGINES)
+    )
+    parser.add_argument("--repeat", type=int, default=_REPEAT)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=_TOLERANCE)
+    parser.add_argument(
+        "--no-row-caps",
+        action="store_true",
+        help="Run every engine at every row count, ignoring the per-engine caps",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    cases = [
+        BenchmarkCase(engine, int(num_rows), num_groups, group_sizes, dtype)
+        for engine in args.engines
+        for num_rows in args.rows
+        for num_groups in args.groups
+        for group_sizes in args.group_sizes
+        for dtype in args.dtypes
+        if args.no_row_caps or num_rows <= _MAX_ROWS.get(engine, num_rows)
+    ]
+    results = run_benchmarks(cases, args.repeat)
+    args.output.write_text(json.dumps({"results": results}, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,122 @@
+import operator
+from functools import reduce
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple, TypeVar, Union
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+_COLUMNS = ["category", "year", "x", "y"]
+_KEY_COLUMNS = ["category", "year", "x"]
+_PL_FLOATS = (pl.Float32, pl.Float64)
+
+ColumnSource = Union[
+    pd.DataFrame, pl.DataFrame, pa.Table, pa.RecordBatch, Mapping[str, np.ndarray]
+]
+PolarsFrame = TypeVar("PolarsFrame", pl.DataFrame, pl.LazyFrame)
+
+
+def _arrow_to_numpy(column: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    # Arrow only hands out its buffer directly for a single chunk
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    values: np.ndarray
+    if column.null_count > 0:
+        # zero_copy_only raises on nulls, they can only become NaN in a copy
+        values = column.to_numpy(zero_copy_only=False)
+    else:
+        values = column.to_numpy(zero_copy_only=True)
+    return values
+
+
+def _column_to_numpy(source: ColumnSource, name: str) -> np.ndarray:
+    values: np.ndarray
+    if isinstance(source, pd.DataFrame):
+        values = source[name].to_numpy()
+    elif isinstance(source, pl.DataFrame):
+        values = source[name].to_numpy()
+    elif isinstance(source, pa.Table):
+        values = _arrow_to_numpy(source.column(name))
+    elif isinstance(source, pa.RecordBatch):
+        values = _arrow_to_numpy(source.column(source.schema.get_field_index(name)))
+    else:
+        # np.asarray drops the memmap subclass without copying the mapped buffer
+        values = np.asarray(source[name])
+    return values
+
+
+def valid_rows(
+    categories: np.ndarray, years: np.ndarray, x_values: np.ndarray
+) -> Optional[np.ndarray]:
+    """
+    Indices of the rows with a category, year and x, or None when no row
+    misses one. A row with a NaN key or x has no place in any group's x
+    order, so every engine drops it
+    """
+    is_missing: Optional[np.ndarray] = None
+    for column in (categories, years, x_values):
+        if np.issubdtype(column.dtype, np.floating):
+            column_missing = np.isnan(column)
+            is_missing = (
+                column_missing if is_missing is None else is_missing | column_missing
+            )
+    if is_missing is None or not is_missing.any():
+        return None
+    rows: np.ndarray = np.flatnonzero(~is_missing)
+    return rows
+
+
+def groupby_columns(
+    source: ColumnSource, drop_missing: bool = True
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The category, year, x and y columns as NumPy arrays that share memory
+    with the source wherever its layout allows it. Arrow columns with nulls
+    are copied instead, with the nulls as NaN, so integer ones become float.
+    Rows with a NaN category, year or x are dropped unless drop_missing is
+    False, which copies the columns only when there are such rows
+    """
+    categories, years, x_values, y_values = (
+        _column_to_numpy(source, name) for name in _COLUMNS
+    )
+    if drop_missing:
+        rows = valid_rows(categories, years, x_values)
+        if rows is not None:
+            categories, years, x_values, y_values = (
+                column[rows] for column in (categories, years, x_values, y_values)
+            )
+    return categories, years, x_values, y_values
+
+
+def drop_missing_rows(frame: PolarsFrame) -> PolarsFrame:
+    """
+    The polars counterpart of valid_rows. pl.from_pandas turns NaN into
+    null, and float columns may hold NaN as well
+    """
+    schema = frame.schema
+    is_present = [pl.col(name).is_not_null() for name in _KEY_COLUMNS]
+    is_present += [
+        pl.col(name).is_not_nan() for name in _KEY_COLUMNS if schema[name] in _PL_FLOATS
+    ]
+    return frame.filter(reduce(operator.and_, is_present))
+
+
+def save_npy_columns(df: pd.DataFrame, directory: Union[str, Path]) -> None:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in _COLUMNS:
+        np.save(directory / f"{name}.npy", df[name].to_numpy())
+
+
+def load_npy_columns(directory: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Memory map the columns written by save_npy_columns, so that multi-GB
+    inputs are paged in by the OS instead of being read into memory
+    """
+    directory = Path(directory)
+    columns: Dict[str, np.ndarray] = {
+        name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _COLUMNS
+    }
+    return columns
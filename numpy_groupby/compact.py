@@ -0,0 +1,134 @@
+"""
+Compact dtypes for the groupby columns.
+
+Key columns are downcast to the narrowest integer type that holds their
+observed range, e.g. int8 for category and int16 for year, like the
+Short/Float Spark schema in spark_args. x and y can optionally be stored as
+float32. compact_report says how much memory that saves and how far the
+groupby result moves from the full precision one.
+
+    python compact.py 1e7 --float-dtype float32
+"""
+
+import argparse
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from columns import ColumnSource, groupby_columns
+from data_generator import generate_columns
+from groupby_profile import _INTERPOLATE_AT, numpy_ragged_groupby
+
+_COLUMNS = ["category", "year", "x", "y"]
+_INTEGER_DTYPES: List[Type[np.signedinteger]] = [np.int8, np.int16, np.int32, np.int64]
+
+
+def compact_integer_dtype(values: np.ndarray) -> np.dtype:
+    """
+    The narrowest signed integer dtype holding every value of an integer
+    column. Other columns, e.g. float keys with NaN, keep their dtype
+    """
+    dtype: np.dtype = values.dtype
+    if len(values) == 0 or not np.issubdtype(dtype, np.integer):
+        return dtype
+    low, high = int(values.min()), int(values.max())
+    for integer_dtype in _INTEGER_DTYPES:
+        limits = np.iinfo(integer_dtype)
+        if limits.min <= low and high <= limits.max:
+            return np.dtype(integer_dtype)
+    return dtype
+
+
+def compact_columns(
+    source: ColumnSource, float_dtype: Optional[str] = None
+) -> Dict[str, np.ndarray]:
+    """
+    The groupby columns with downcast keys, and x and y in float_dtype
+    when given. Columns that are already compact are not copied
+    """
+    categories, years, x_values, y_values = groupby_columns(source, drop_missing=False)
+    columns = {
+        "category": categories.astype(compact_integer_dtype(categories), copy=False),
+        "year": years.astype(compact_integer_dtype(years), copy=False),
+        "x": x_values,
+        "y": y_values,
+    }
+    if float_dtype is not None:
+        columns["x"] = x_values.astype(float_dtype, copy=False)
+        columns["y"] = y_values.astype(float_dtype, copy=False)
+    return columns
+
+
+def _columns_nbytes(source: ColumnSource) -> int:
+    return sum(column.nbytes for column in groupby_columns(source, drop_missing=False))
+
+
+@dataclass(frozen=True)
+class CompactReport:
+    original_bytes: int
+    compact_bytes: int
+    dtypes: Dict[str, str]
+    # Largest differences of the groupby result against full precision
+    max_abs_error: float
+    max_rel_error: float
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.compact_bytes
+
+    @property
+    def saved_fraction(self) -> float:
+        return self.saved_bytes / self.original_bytes if self.original_bytes else 0.0
+
+    def __str__(self) -> str:
+        dtypes = ", ".join(f"{name} {dtype}" for name, dtype in self.dtypes.items())
+        return (
+            f"{dtypes}: {self.original_bytes / 2**20:,.1f} MB -> "
+            f"{self.compact_bytes / 2**20:,.1f} MB ({self.saved_fraction:.0%} saved), "
+            f"max abs error {self.max_abs_error:.3g}, "
+            f"max rel error {self.max_rel_error:.3g}"
+        )
+
+
+def compact_report(
+    source: ColumnSource,
+    float_dtype: Optional[str] = None,
+    groupby: Callable[..., pd.DataFrame] = numpy_ragged_groupby,
+    interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+) -> CompactReport:
+    """
+    Memory of the groupby columns before and after compact_columns, and the
+    error the compact columns introduce into the result of groupby
+    """
+    columns = dict(zip(_COLUMNS, groupby_columns(source)))
+    compact = compact_columns(columns, float_dtype)
+
+    expected = groupby(columns, interpolate_at)["y"].to_numpy(dtype=np.float64)
+    result = groupby(compact, interpolate_at)["y"].to_numpy(dtype=np.float64)
+    abs_errors = np.abs(result - expected)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_errors = abs_errors / np.abs(expected)
+
+    return CompactReport(
+        original_bytes=_columns_nbytes(columns),
+        compact_bytes=_columns_nbytes(compact),
+        dtypes={name: str(column.dtype) for name, column in compact.items()},
+        max_abs_error=float(np.nanmax(abs_errors, initial=0.0)),
+        max_rel_error=float(
+            np.nanmax(rel_errors[np.isfinite(rel_errors)], initial=0.0)
+        ),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("num_rows", type=float)
+    parser.add_argument("--float-dtype", choices=["float32"])
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    columns = generate_columns(int(args.num_rows), skew=args.skew, seed=args.seed)
+    print(compact_report(columns, args.float_dtype))
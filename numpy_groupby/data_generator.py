@@ -0,0 +1,226 @@
+"""
+Vectorized synthetic (category, year, x, y) data for the groupby benchmarks.
+
+    python data_generator.py 1e8 data/rows.parquet --skew 1.5
+"""
+
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+_COLUMNS = ["category", "year", "x", "y"]
+_NUM_CATEGORIES = 3
+_FIRST_YEAR = 2010
+_NUM_YEARS = 11
+_CHUNK_ROWS = 10_000_000
+
+Columns = Dict[str, np.ndarray]
+
+
+def _y_values(rng: np.random.Generator, x_values: np.ndarray) -> np.ndarray:
+    # y follows a float32 x, but stays float64 for integer x grids
+    dtype = x_values.dtype if np.issubdtype(x_values.dtype, np.floating) else np.float64
+    noise = rng.uniform(0, 1, len(x_values)).astype(dtype)
+    y_values: np.ndarray = 25.0 * x_values + noise
+    return y_values
+
+
+def grid_columns(
+    categories: Sequence[int],
+    years: Sequence[int],
+    x_values: Sequence[float],
+    seed: Optional[int] = 0,
+) -> Columns:
+    """
+    Every (category, year, x) combination, in the same order as nested
+    loops over categories, years and x would produce them
+    """
+    rng = np.random.default_rng(seed)
+    category_grid, year_grid, x_grid = np.meshgrid(
+        np.asarray(categories), np.asarray(years), np.asarray(x_values), indexing="ij"
+    )
+    x_column = x_grid.ravel()
+    return {
+        "category": category_grid.ravel(),
+        "year": year_grid.ravel(),
+        "x": x_column,
+        "y": _y_values(rng, x_column),
+    }
+
+
+def _group_probabilities(num_groups: int, skew: float) -> np.ndarray:
+    # Zipf-like weights, skew=0 gives every group the same expected size
+    weights = 1.0 / np.arange(1, num_groups + 1) ** skew
+    probabilities: np.ndarray = weights / weights.sum()
+    return probabilities
+
+
+def _random_columns(
+    rng: np.random.Generator,
+    num_rows: int,
+    group_probabilities: np.ndarray,
+    num_years: int,
+    num_x_values: Optional[int],
+    dtype: str,
+    shuffle: bool,
+) -> Columns:
+    # Keys are looked up per group and gathered, which is much cheaper
+    # than dividing every row's group id
+    group_numbers = np.arange(len(group_probabilities))
+    group_categories = group_numbers // num_years
+    group_years = _FIRST_YEAR + group_numbers % num_years
+
+    if shuffle:
+        group_ids = rng.choice(
+            len(group_probabilities), num_rows, p=group_probabilities
+        )
+        categories, years = group_categories[group_ids], group_years[group_ids]
+    else:
+        group_sizes = rng.multinomial(num_rows, group_probabilities)
+        categories = np.repeat(group_categories, group_sizes)
+        years = np.repeat(group_years, group_sizes)
+
+    if num_x_values is None:
+        x_values = rng.random(num_rows, dtype=np.dtype(dtype).type)
+    else:
+        x_grid = np.linspace(0, 1, num_x_values, dtype=dtype)
+        x_values = x_grid[rng.integers(0, num_x_values, num_rows)]
+
+    return {
+        "category": categories,
+        "year": years,
+        "x": x_values,
+        "y": _y_values(rng, x_values),
+    }
+
+
+def generate_chunks(
+    num_rows: int,
+    chunk_rows: int = _CHUNK_ROWS,
+    num_categories: int = _NUM_CATEGORIES,
+    num_years: int = _NUM_YEARS,
+    skew: float = 0.0,
+    num_x_values: Optional[int] = None,
+    dtype: str = "float64",
+    shuffle: bool = True,
+    seed: Optional[int] = 0,
+) -> Iterator[Columns]:
+    """
+    Rows with random group sizes drawn from Zipf-like weights, in chunks of
+    at most chunk_rows. Each chunk has its own seeded stream, so the output
+    only depends on seed and chunk_rows. x is uniform on [0, 1), or picked
+    from num_x_values grid points when given. Without shuffle the rows
+    of each chunk come out sorted by (category, year)
+    """
+    group_probabilities = _group_probabilities(num_categories * num_years, skew)
+    num_chunks = -(-num_rows // chunk_rows)
+    chunk_seeds = np.random.SeedSequence(seed).spawn(num_chunks)
+
+    for chunk, chunk_seed in enumerate(chunk_seeds):
+        yield _random_columns(
+            np.random.default_rng(chunk_seed),
+            min(chunk_rows, num_rows - chunk * chunk_rows),
+            group_probabilities,
+            num_years,
+            num_x_values,
+            dtype,
+            shuffle,
+        )
+
+
+def generate_columns(num_rows: int, **kwargs: Any) -> Columns:
+    chunks = list(generate_chunks(num_rows, **kwargs))
+    if not chunks:
+        return {name: np.empty(0) for name in _COLUMNS}
+    return {
+        name: np.concatenate([chunk[name] for chunk in chunks]) for name in _COLUMNS
+    }
+
+
+def generate_dataframe(num_rows: int, **kwargs: Any) -> pd.DataFrame:
+    return pd.DataFrame(generate_columns(num_rows, **kwargs))
+
+
+def to_arrow(columns: Columns) -> pa.Table:
+    return pa.table(columns)
+
+
+def write_parquet(path: Union[str, Path], chunks: Iterator[Columns]) -> None:
+    writer: Optional[pq.ParquetWriter] = None
+    for chunk in chunks:
+        table = to_arrow(chunk)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+def write_npy(
+    directory: Union[str, Path], num_rows: int, chunks: Iterator[Columns]
+) -> None:
+    """
+    One .npy file per column, as read back by columns.load_npy_columns.
+    Chunks are written straight into memory mapped files
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    outputs: Dict[str, np.ndarray] = {}
+    start = 0
+    for chunk in chunks:
+        end = start + len(chunk["x"])
+        for name in _COLUMNS:
+            if name not in outputs:
+                outputs[name] = np.lib.format.open_memmap(
+                    directory / f"{name}.npy",
+                    mode="w+",
+                    dtype=chunk[name].dtype,
+                    shape=(num_rows,),
+                )
+            outputs[name][start:end] = chunk[name]
+        start = end
+
+    for output in outputs.values():
+        output.flush()  # type: ignore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("num_rows", type=float)
+    parser.add_argument(
+        "output", type=Path, help="A .parquet file or a directory for .npy columns"
+    )
+    parser.add_argument("--chunk-rows", type=int, default=_CHUNK_ROWS)
+    parser.add_argument("--num-categories", type=int, default=_NUM_CATEGORIES)
+    parser.add_argument("--num-years", type=int, default=_NUM_YEARS)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--num-x-values", type=int)
+    parser.add_argument("--dtype", default="float64", choices=["float64", "float32"])
+    parser.add_argument(
+        "--sorted", action="store_true", help="Keep each chunk sorted by group"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    num_rows = int(args.num_rows)
+    chunks = generate_chunks(
+        num_rows,
+        chunk_rows=args.chunk_rows,
+        num_categories=args.num_categories,
+        num_years=args.num_years,
+        skew=args.skew,
+        num_x_values=args.num_x_values,
+        dtype=args.dtype,
+        shuffle=not args.sorted,
+        seed=args.seed,
+    )
+    if args.output.suffix == ".parquet":
+        write_parquet(args.output, chunks)
+    else:
+        write_npy(args.output, num_rows, chunks)
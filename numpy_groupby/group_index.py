@@ -0,0 +1,213 @@
+"""
+Reusable sort of the (category, year, x) keys for repeated groupbys.
+
+Building a GroupIndex pays for key encoding, the sort and the segment
+offsets once. Interpolating a new y column afterwards only gathers the
+rows bracketing each query point, so a call costs O(groups * queries)
+instead of a full sort. GroupIndexCache rebuilds an index only when the
+fingerprint of the key columns changes.
+
+    cache = GroupIndexCache()
+    for df in frames_with_fixed_keys:
+        cache.get(df).interpolate(df["y"].to_numpy(), [0.3, 0.5])
+"""
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from columns import ColumnSource, groupby_columns, valid_rows
+from groupby_profile import (
+    _INTERPOLATE_AT,
+    _interpolated_frame,
+    _lerp,
+    _query_points,
+    _segment_brackets,
+    _sort_groups,
+)
+from segment_reduce import SortedSegments
+
+_CACHE_SIZE = 8
+_BRACKETS_CACHE_SIZE = 16
+
+# Row positions of the lower and upper neighbours of every query point,
+# with the query x and neighbour x values, one row per group
+Brackets = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def fingerprint_keys(
+    categories: np.ndarray, years: np.ndarray, x_values: np.ndarray
+) -> str:
+    """
+    A digest of the key columns' dtypes and bytes. Hashing is a single
+    O(n) pass, much cheaper than the sort a GroupIndex saves
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for column in (categories, years, x_values):
+        column = np.ascontiguousarray(column)
+        digest.update(f"{column.dtype.str}{column.shape}".encode())
+        digest.update(column.data.cast("B"))
+    return digest.hexdigest()
+
+
+@dataclass
+class GroupIndex:
+    """
+    The sort permutation of the input rows by (category, year, x), the
+    segment offsets and keys of every group, the sorted x values and the
+    unique x grid. Rows with a NaN key or x are left out of sort_indices, so
+    num_rows may exceed it. Only valid for inputs whose key columns match
+    fingerprint
+    """
+
+    sort_indices: np.ndarray
+    offsets: np.ndarray
+    categories: np.ndarray
+    years: np.ndarray
+    sorted_x: np.ndarray
+    x_grid: np.ndarray
+    num_rows: int
+    fingerprint: str
+    _brackets: "OrderedDict[bytes, Brackets]" = field(
+        default_factory=OrderedDict, repr=False
+    )
+
+    @classmethod
+    def build(cls, df: ColumnSource, fingerprint: Optional[str] = None) -> "GroupIndex":
+        categories, years, x_values, _ = groupby_columns(df, drop_missing=False)
+        num_rows = len(x_values)
+        fingerprint = fingerprint or fingerprint_keys(categories, years, x_values)
+        rows = valid_rows(categories, years, x_values)
+        if rows is not None:
+            categories, years, x_values = categories[rows], years[rows], x_values[rows]
+
+        sort_indices, offsets, group_categories, group_years, x_grid = _sort_groups(
+            categories, years, x_values
+        )
+        sorted_x = x_values[sort_indices]
+        if rows is not None:
+            # Back to positions in the input, which y columns are indexed by
+            sort_indices = rows[sort_indices]
+        return cls(
+            sort_indices,
+            offsets,
+            group_categories,
+            group_years,
+            sorted_x,
+            x_grid,
+            num_rows,
+            fingerprint,
+        )
+
+    def matches(self, df: ColumnSource) -> bool:
+        categories, years, x_values, _ = groupby_columns(df, drop_missing=False)
+        return fingerprint_keys(categories, years, x_values) == self.fingerprint
+
+    def _query_brackets(self, query_points: np.ndarray) -> Brackets:
+        # Finding the neighbours is the only step that depends on the query
+        # points, so it is kept for the most recently used sets of points
+        cache_key = query_points.tobytes()
+        brackets = self._brackets.get(cache_key)
+        if brackets is None:
+            x, lower, upper, _ = _segment_brackets(
+                query_points[np.newaxis, :], self.sorted_x, self.offsets
+            )
+            brackets = (lower, upper, x, self.sorted_x[lower], self.sorted_x[upper])
+            self._brackets[cache_key] = brackets
+        self._brackets.move_to_end(cache_key)
+        while len(self._brackets) > _BRACKETS_CACHE_SIZE:
+            self._brackets.popitem(last=False)
+        return brackets
+
+    def interpolate_values(
+        self,
+        y_values: np.ndarray,
+        interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+    ) -> np.ndarray:
+        """
+        y at every query point for every group, shape (groups, queries),
+        from the y column of an input with the indexed key layout
+        """
+        if len(y_values) != self.num_rows:
+            raise ValueError(
+                f"GroupIndex was built for {self.num_rows} rows, got {len(y_values)}"
+            )
+
+        query_points = _query_points(interpolate_at)
+        lower, upper, x, x_lower, x_upper = self._query_brackets(query_points)
+        f_lower = y_values[self.sort_indices[lower]]
+        f_upper = y_values[self.sort_indices[upper]]
+        return _lerp(x, x_lower, x_upper, f_lower, f_upper).reshape(
+            -1, len(query_points)
+        )
+
+    def interpolate(
+        self,
+        y_values: np.ndarray,
+        interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+    ) -> pd.DataFrame:
+        return _interpolated_frame(
+            self.categories,
+            self.years,
+            interpolate_at,
+            self.interpolate_values(y_values, interpolate_at),
+        )
+
+    def sorted_segments(self, y_values: np.ndarray) -> SortedSegments:
+        """
+        The segments of a new y column, ready for segment_reduce
+        """
+        return SortedSegments(
+            self.categories,
+            self.years,
+            self.offsets,
+            self.sorted_x,
+            y_values[self.sort_indices],
+        )
+
+
+class GroupIndexCache:
+    """
+    The most recently used GroupIndex objects, looked up by the fingerprint
+    of the key columns so that a changed key layout gets a fresh index
+    """
+
+    def __init__(self, max_size: int = _CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self._indexes: "OrderedDict[str, GroupIndex]" = OrderedDict()
+
+    def get(self, df: ColumnSource) -> GroupIndex:
+        categories, years, x_values, _ = groupby_columns(df, drop_missing=False)
+        fingerprint = fingerprint_keys(categories, years, x_values)
+
+        index: Optional[GroupIndex] = self._indexes.get(fingerprint)
+        if index is None:
+            index = GroupIndex.build(df, fingerprint)
+            self._indexes[fingerprint] = index
+        self._indexes.move_to_end(fingerprint)
+        while len(self._indexes) > self.max_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    def clear(self) -> None:
+        self._indexes.clear()
+
+
+_DEFAULT_CACHE = GroupIndexCache()
+
+
+def indexed_groupby(
+    df: ColumnSource,
+    interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+    cache: GroupIndexCache = _DEFAULT_CACHE,
+) -> pd.DataFrame:
+    """
+    Same result as numpy_ragged_groupby, reusing the sort of any earlier
+    call whose key columns were identical
+    """
+    _, _, _, y_values = groupby_columns(df, drop_missing=False)
+    return cache.get(df).interpolate(y_values, interpolate_at)
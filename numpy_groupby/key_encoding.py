@@ -0,0 +1,97 @@
+import math
+from typing import List, Sequence, Tuple
+
+import numba as nb
+import numpy as np
+
+# Keep the counts array of a counting sort within a few tens of MB
+_MAX_COUNTING_SORT_KEYS = 1 << 22
+
+
+def column_codes(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dense codes in [0, cardinality) for a column, and the values the
+    codes stand for. Integer columns with a narrow range, like category
+    and year, are offset by their minimum instead of being sorted
+    """
+    if np.issubdtype(values.dtype, np.integer) and len(values) > 0:
+        low, high = values.min(), values.max()
+        if int(high) - int(low) < len(values):
+            # Widen first, a narrow dtype like int8 would wrap on the subtraction
+            codes = (values.astype(np.int64) - int(low)).astype(np.uint64)
+            return codes, np.arange(low, high + 1, dtype=values.dtype)
+
+    uniques, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.uint64), uniques
+
+
+def encode_keys(
+    columns: Sequence[np.ndarray],
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Pack several key columns into one uint64 per row, first column most
+    significant, so sorting the packed key is the same as lexsorting the
+    columns. Returns the packed keys and the unique values of each column
+    """
+    packed = np.zeros(len(columns[0]), dtype=np.uint64)
+    uniques = []
+    key_space = 1
+    for values in columns:
+        codes, column_uniques = column_codes(values)
+        key_space *= max(len(column_uniques), 1)
+        if key_space > np.iinfo(np.int64).max:
+            raise ValueError("Key cardinalities do not fit in a 64 bit key")
+
+        packed = packed * np.uint64(len(column_uniques)) + codes
+        uniques.append(column_uniques)
+    return packed, uniques
+
+
+def decode_keys(packed: np.ndarray, uniques: Sequence[np.ndarray]) -> List[np.ndarray]:
+    columns = []
+    for column_uniques in reversed(uniques):
+        cardinality = np.uint64(len(column_uniques))
+        columns.append(column_uniques[packed % cardinality])
+        packed = packed // cardinality
+    return columns[::-1]
+
+
+def key_space_size(uniques: Sequence[np.ndarray]) -> int:
+    return math.prod(len(column_uniques) for column_uniques in uniques)
+
+
+def argsort_packed(packed: np.ndarray, key_space: int) -> np.ndarray:
+    # NumPy's stable sort is a radix sort for 16 bit integers
+    if key_space <= np.iinfo(np.uint16).max + 1:
+        return np.argsort(packed.astype(np.uint16), kind="stable")
+    return np.argsort(packed, kind="stable")
+
+
+@nb.njit(nogil=True, cache=True)
+def counting_argsort(packed: np.ndarray, key_space: int) -> np.ndarray:
+    counts = np.zeros(key_space, dtype=np.int64)
+    for i in range(len(packed)):
+        counts[packed[i]] += 1
+
+    offsets = np.empty(key_space, dtype=np.int64)
+    total = 0
+    for key in range(key_space):
+        offsets[key] = total
+        total += counts[key]
+
+    sort_indices = np.empty(len(packed), dtype=np.int64)
+    for i in range(len(packed)):
+        key = packed[i]
+        sort_indices[offsets[key]] = i
+        offsets[key] += 1
+    return sort_indices
+
+
+@nb.njit(nogil=True, cache=True)
+def njit_argsort_packed(packed: np.ndarray, key_space: int) -> np.ndarray:
+    sort_indices: np.ndarray
+    if key_space <= _MAX_COUNTING_SORT_KEYS:
+        sort_indices = counting_argsort(packed, key_space)
+    else:
+        sort_indices = np.argsort(packed, kind="mergesort")
+    return sort_indices
@@ -1,11 +1,24 @@
 # https://github.com/numba/numba/issues/5688
+#
+# A standalone numba lexsort, benchmarked against np.lexsort by running this
+# module. The groupbys sort packed keys with key_encoding instead, which is faster
+
+import sys
+import timeit
+from typing import Tuple
 
-from numba import njit, literal_unroll
+import numba as nb
 import numpy as np
+from numba import literal_unroll, njit, prange
+
+# Runs shorter than this are insertion sorted before merging starts
+_MIN_RUN = 32
 
+_BENCHMARK_SIZES = [10**5, 10**6, 10**7, 10**8]
 
-@njit
-def cmp_fn(left, right, *arrays):
+
+@njit(nogil=True, cache=True)
+def cmp_fn(left: int, right: int, *arrays: np.ndarray) -> int:
     for a in literal_unroll(arrays):
         if a[left] < a[right]:
             return -1  # less than
@@ -15,40 +28,80 @@ def cmp_fn(left, right, *arrays):
     return 0  # equal
 
 
-@njit
-def quicksort(index, Left, Right, *arrays):
-    left, right = Left, Right
-    pivot = index[(left + right) // 2]
-
-    while True:
-        while left < Right and cmp_fn(index[left], pivot, *arrays) == -1:
+@njit(nogil=True, cache=True)
+def _insertion_sort(
+    index: np.ndarray, start: int, end: int, *arrays: np.ndarray
+) -> None:
+    for i in range(start + 1, end):
+        current = index[i]
+        j = i - 1
+        # Strict comparison keeps equal keys in their original order
+        while j >= start and cmp_fn(current, index[j], *arrays) == -1:
+            index[j + 1] = index[j]
+            j -= 1
+        index[j + 1] = current
+
+
+@njit(nogil=True, cache=True)
+def _merge(
+    source: np.ndarray,
+    target: np.ndarray,
+    start: int,
+    middle: int,
+    end: int,
+    *arrays: np.ndarray,
+) -> None:
+    left, right = start, middle
+    for k in range(start, end):
+        # Taking from the left run on ties is what makes the sort stable
+        if left < middle and (
+            right >= end or cmp_fn(source[right], source[left], *arrays) != -1
+        ):
+            target[k] = source[left]
             left += 1
-        while right >= Left and cmp_fn(pivot, index[right], *arrays) == -1:
-            right -= 1
-
-        if left >= right:
-            break
-
-        index[left], index[right] = index[right], index[left]
-        left += 1
-        right -= 1
-
-        if Left < right:
-            quicksort(index, Left, right, *arrays)
-
-        if left < Right:
-            quicksort(index, left, Right, *arrays)
-
-
-@njit(nogil=True, cache=True, debug=True)
-def lexsort(arrays):
-    # print("starting lexsort")
-
+        else:
+            target[k] = source[right]
+            right += 1
+
+
+@njit(nogil=True, cache=True)
+def _merge_sort(
+    index: np.ndarray, buffer: np.ndarray, start: int, end: int, *arrays: np.ndarray
+) -> None:
+    """
+    Bottom up merge sort of index[start:end], using the same range of
+    buffer as scratch space. The result always ends up in index
+    """
+    for run_start in range(start, end, _MIN_RUN):
+        _insertion_sort(index, run_start, min(run_start + _MIN_RUN, end), *arrays)
+
+    source, target = index, buffer
+    in_buffer = False
+    width = _MIN_RUN
+    while width < end - start:
+        for left in range(start, end, 2 * width):
+            middle = min(left + width, end)
+            right = min(left + 2 * width, end)
+            _merge(source, target, left, middle, right, *arrays)
+        source, target = target, source
+        in_buffer = not in_buffer
+        width *= 2
+
+    if in_buffer:
+        index[start:end] = buffer[start:end]
+
+
+@njit(nogil=True, cache=True)
+def lexsort(arrays: Tuple[np.ndarray, ...]) -> np.ndarray:
+    """
+    Stable, non-recursive lexsort. Unlike np.lexsort the first array
+    is the primary key
+    """
     if len(arrays) == 0:
         return np.empty((), dtype=np.intp)
 
     if len(arrays) == 1:
-        return np.argsort(arrays[0])
+        return np.argsort(arrays[0], kind="mergesort")
 
     for a in literal_unroll(arrays[1:]):
         if a.shape != arrays[0].shape:
@@ -56,16 +109,90 @@ def lexsort(arrays):
 
     n = arrays[0].shape[0]
     index = np.arange(n)
+    buffer = np.empty_like(index)
 
-    quicksort(index, 0, n - 1, *arrays)
+    _merge_sort(index, buffer, 0, n, *arrays)
 
-    # print("ending lexsort")
     return index
 
 
-# a = np.array([2, 1, 4, 3, 0], dtype=np.int32)
-# b = np.array([1, 2, 3, 4, 5], dtype=np.float64)
-#
-# print("before lexsort")
-# print(lexsort((a, b)))
-# print("after lexsort")
+@njit(nogil=True, cache=True, parallel=True)
+def _parallel_merge_sort(num_chunks: int, arrays: Tuple[np.ndarray, ...]) -> np.ndarray:
+    n = arrays[0].shape[0]
+    index = np.arange(n)
+    buffer = np.empty_like(index)
+
+    chunk_size = (n + num_chunks - 1) // num_chunks
+    for chunk in prange(num_chunks):
+        start = chunk * chunk_size
+        _merge_sort(index, buffer, start, min(start + chunk_size, n), *arrays)
+
+    source, target = index, buffer
+    in_buffer = False
+    width = chunk_size
+    while width < n:
+        num_merges = (n + 2 * width - 1) // (2 * width)
+        for merge in prange(num_merges):
+            left = merge * 2 * width
+            middle = min(left + width, n)
+            right = min(left + 2 * width, n)
+            _merge(source, target, left, middle, right, *arrays)
+        source, target = target, source
+        in_buffer = not in_buffer
+        width *= 2
+
+    if in_buffer:
+        index[:] = buffer
+
+    return index
+
+
+def parallel_lexsort(arrays: Tuple[np.ndarray, ...]) -> np.ndarray:
+    """
+    lexsort that sorts one chunk per thread and then merges
+    the sorted chunks pairwise, each level of merges in parallel
+    """
+    sorted_index: np.ndarray
+    if len(arrays) < 2:
+        sorted_index = lexsort(arrays)
+        return sorted_index
+
+    for a in arrays[1:]:
+        if a.shape != arrays[0].shape:
+            raise ValueError("lexsort array shapes don't match")
+
+    num_chunks = max(1, min(nb.get_num_threads(), arrays[0].shape[0] // _MIN_RUN))
+    sorted_index = _parallel_merge_sort(num_chunks, arrays)
+    return sorted_index
+
+
+def _benchmark_arrays(size: int) -> Tuple[np.ndarray, ...]:
+    # Low cardinality leading keys, like category and year in groupby_profile
+    rng = np.random.default_rng(42)
+    return (
+        rng.integers(0, 3, size),
+        rng.integers(2010, 2021, size),
+        rng.random(size),
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(float(size)) for size in sys.argv[1:]] or _BENCHMARK_SIZES
+    for size in sizes:
+        categories, years, x_values = _benchmark_arrays(size)
+        keys = (categories, years, x_values)
+        # Compile outside of the timings
+        lexsort(tuple(key[:10] for key in keys))
+        parallel_lexsort(tuple(key[:10] for key in keys))
+
+        numpy_time = min(
+            timeit.repeat(lambda: np.lexsort(keys[::-1]), number=1, repeat=3)
+        )
+        lexsort_time = min(timeit.repeat(lambda: lexsort(keys), number=1, repeat=3))
+        parallel_time = min(
+            timeit.repeat(lambda: parallel_lexsort(keys), number=1, repeat=3)
+        )
+        print(
+            f"{size:>11,} rows: np.lexsort {numpy_time:.3f}s, "
+            f"lexsort {lexsort_time:.3f}s, parallel_lexsort {parallel_time:.3f}s"
+        )
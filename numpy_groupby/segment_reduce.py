@@ -0,0 +1,190 @@
+"""
+Several per-(category, year) metrics from one sort of the input.
+
+The expensive step, encoding and sorting the keys and finding the segment
+offsets, is done once by sort_segments. Every reducer then makes one
+vectorized or njit pass over the sorted segments, and segment_reduce puts
+all of their columns side by side in one wide frame.
+
+    segment_reduce(df, {
+        "y": interpolate_reducer([0.3, 0.5]),
+        "area": trapezoid_reducer,
+        "slope": slope_reducer,
+        "p": percentile_reducer([50, 90]),
+    })
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Mapping, Sequence, Union
+
+import numba as nb
+import numpy as np
+import pandas as pd
+
+from columns import ColumnSource, groupby_columns
+from groupby_profile import _sort_groups, segment_interpolate
+
+
+@dataclass(frozen=True)
+class SortedSegments:
+    """
+    Rows sorted by (category, year, x). Group i spans offsets[i]:offsets[i + 1]
+    of x and y and has the key (categories[i], years[i])
+    """
+
+    categories: np.ndarray
+    years: np.ndarray
+    offsets: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.offsets[:-1]
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+# A reducer turns the sorted segments into one or more columns with one
+# value per group. Parameterised reducers are built by the *_reducer factories
+Reducer = Callable[[SortedSegments], Dict[str, np.ndarray]]
+
+
+def sort_segments(df: ColumnSource) -> SortedSegments:
+    categories, years, x_values, y_values = groupby_columns(df)
+    sort_indices, offsets, group_categories, group_years, _ = _sort_groups(
+        categories, years, x_values
+    )
+    return SortedSegments(
+        group_categories,
+        group_years,
+        offsets,
+        x_values[sort_indices],
+        y_values[sort_indices],
+    )
+
+
+def _column_label(value: float) -> str:
+    # The shortest digits that round trip, so distinct points keep distinct
+    # columns, without the trailing ".0" of repr for whole numbers
+    return np.format_float_positional(value, trim="-")
+
+
+def interpolate_reducer(interpolate_at: Union[float, Sequence[float]]) -> Reducer:
+    """
+    y at each of the given x, one column per point. Same values as
+    numpy_ragged_groupby
+    """
+    query_points = np.atleast_1d(np.asarray(interpolate_at, dtype=np.float64))
+
+    def reduce(segments: SortedSegments) -> Dict[str, np.ndarray]:
+        interpolated = segment_interpolate(
+            query_points[np.newaxis, :], segments.x, segments.y, segments.offsets
+        )
+        return {
+            _column_label(point): interpolated[:, i]
+            for i, point in enumerate(query_points)
+        }
+
+    return reduce
+
+
+def trapezoid_reducer(segments: SortedSegments) -> Dict[str, np.ndarray]:
+    """
+    Integral of y over x by the trapezoidal rule, 0 for single-row groups
+    """
+    # The area between row j - 1 and row j, zeroed where a segment starts
+    areas = np.zeros(len(segments.x), dtype=np.float64)
+    areas[1:] = 0.5 * (segments.y[1:] + segments.y[:-1]) * np.diff(segments.x)
+    areas[segments.starts] = 0.0
+    return {"": np.add.reduceat(areas, segments.starts)}
+
+
+def min_max_reducer(segments: SortedSegments) -> Dict[str, np.ndarray]:
+    return {
+        "min": np.minimum.reduceat(segments.y, segments.starts),
+        "max": np.maximum.reduceat(segments.y, segments.starts),
+    }
+
+
+@nb.njit(nogil=True, cache=True)
+def _segment_argmax(offsets: np.ndarray, values: np.ndarray) -> np.ndarray:
+    num_groups = len(offsets) - 1
+    argmax = np.empty(num_groups, dtype=np.int64)
+    for i in range(num_groups):
+        start, end = offsets[i], offsets[i + 1]
+        argmax[i] = start + np.argmax(values[start:end])
+    return argmax
+
+
+def argmax_reducer(segments: SortedSegments) -> Dict[str, np.ndarray]:
+    """
+    The x at which y peaks, the smallest such x on ties
+    """
+    return {"x": segments.x[_segment_argmax(segments.offsets, segments.y)]}
+
+
+def slope_reducer(segments: SortedSegments) -> Dict[str, np.ndarray]:
+    """
+    Least squares slope of y on x, NaN where all x of a group are equal
+    """
+    sizes = segments.sizes
+    x_means = np.add.reduceat(segments.x, segments.starts) / sizes
+    y_means = np.add.reduceat(segments.y, segments.starts) / sizes
+
+    # Centring on the group means keeps the sums well conditioned
+    x_centred = segments.x - np.repeat(x_means, sizes)
+    y_centred = segments.y - np.repeat(y_means, sizes)
+    covariances = np.add.reduceat(x_centred * y_centred, segments.starts)
+    variances = np.add.reduceat(x_centred * x_centred, segments.starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"": np.where(variances > 0, covariances / variances, np.nan)}
+
+
+@nb.njit(nogil=True, cache=True)
+def _segment_percentiles(
+    offsets: np.ndarray, values: np.ndarray, percentiles: np.ndarray
+) -> np.ndarray:
+    num_groups = len(offsets) - 1
+    result = np.empty((num_groups, len(percentiles)))
+    for i in range(num_groups):
+        start, end = offsets[i], offsets[i + 1]
+        result[i, :] = np.percentile(values[start:end], percentiles)
+    return result
+
+
+def percentile_reducer(percentiles: Union[float, Sequence[float]]) -> Reducer:
+    """
+    Percentiles of y within each group, one column per percentile
+    """
+    percentile_points = np.atleast_1d(np.asarray(percentiles, dtype=np.float64))
+
+    def reduce(segments: SortedSegments) -> Dict[str, np.ndarray]:
+        values = _segment_percentiles(
+            segments.offsets, segments.y.astype(np.float64), percentile_points
+        )
+        return {
+            _column_label(percentile): values[:, i]
+            for i, percentile in enumerate(percentile_points)
+        }
+
+    return reduce
+
+
+def segment_reduce(
+    df: Union[ColumnSource, SortedSegments], reducers: Mapping[str, Reducer]
+) -> pd.DataFrame:
+    """
+    One row per (category, year) with a column for every reducer output,
+    named "<reducer>_<output>", or just "<reducer>" for unnamed outputs.
+    Pass a SortedSegments to reuse a sort across calls
+    """
+    segments = df if isinstance(df, SortedSegments) else sort_segments(df)
+
+    data = {"category": segments.categories, "year": segments.years}
+    for name, reducer in reducers.items():
+        for output, column in reducer(segments).items():
+            data[f"{name}_{output}" if output else name] = column
+    return pd.DataFrame(data)
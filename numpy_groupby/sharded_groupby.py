@@ -0,0 +1,194 @@
+"""
+Multi-process numpy groupby-interpolate over shared memory shards.
+
+The driver hash partitions the rows on (category, year) and copies the
+columns, shard by shard, into multiprocessing.shared_memory blocks. Each
+worker attaches to the blocks, runs numpy_ragged_groupby on its own slice
+and writes the interpolated values into a shared output block at an offset
+the driver computed up front. Only block names and offsets cross process
+boundaries, never frames.
+
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(mp_context=spawn) as executor:
+        for df in frames:
+            sharded_groupby(df, [0.3, 0.5], executor=executor)
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from columns import ColumnSource, groupby_columns
+from groupby_profile import (
+    _INTERPOLATE_AT,
+    _interpolated_frame,
+    _query_points,
+    numpy_ragged_groupby,
+)
+from key_encoding import argsort_packed, decode_keys, encode_keys, key_space_size
+
+_COLUMNS = ["category", "year", "x", "y"]
+# Fibonacci hashing spreads neighbouring group keys over the shards
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """
+    A picklable handle to a 1-D array in a shared memory block
+    """
+
+    name: str
+    dtype: str
+    size: int
+
+    @classmethod
+    def create(
+        cls, stack: ExitStack, dtype: np.dtype, size: int
+    ) -> Tuple["SharedArray", np.ndarray]:
+        # SharedMemory refuses zero sized blocks
+        block = shared_memory.SharedMemory(
+            create=True, size=max(size * dtype.itemsize, 1)
+        )
+        stack.callback(block.unlink)
+        stack.callback(block.close)
+        handle = cls(block.name, dtype.str, size)
+        return handle, handle.view(block)
+
+    def view(self, block: shared_memory.SharedMemory) -> np.ndarray:
+        return np.ndarray((self.size,), dtype=np.dtype(self.dtype), buffer=block.buf)
+
+    def attach(self) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+        # Pool workers share the driver's resource tracker, so the block
+        # stays registered once and is only unlinked by the driver
+        block = shared_memory.SharedMemory(name=self.name)
+        return block, self.view(block)
+
+
+def _shard_ids(group_codes: np.ndarray, num_shards: int) -> np.ndarray:
+    return ((group_codes * _HASH_MULTIPLIER) >> np.uint64(32)) % np.uint64(num_shards)
+
+
+def _interpolate_shard(
+    columns: Dict[str, SharedArray],
+    output: SharedArray,
+    row_range: Tuple[int, int],
+    output_range: Tuple[int, int],
+    interpolate_at: Union[float, np.ndarray],
+) -> None:
+    """
+    Runs in a worker: groupby-interpolate rows row_range of the shared
+    columns into output_range of the shared output
+    """
+    row_start, row_end = row_range
+    output_start, output_end = output_range
+    blocks = []
+    shard = {}
+    try:
+        for name, handle in columns.items():
+            block, values = handle.attach()
+            blocks.append(block)
+            shard[name] = values[row_start:row_end]
+
+        output_block, output_values = output.attach()
+        blocks.append(output_block)
+        interpolated = numpy_ragged_groupby(shard, _query_points(interpolate_at))
+        output_values[output_start:output_end] = interpolated["y"]
+        # The views must go before their blocks can be closed
+        del shard, values, output_values, interpolated
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def sharded_groupby(
+    df: ColumnSource,
+    interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+    num_shards: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> pd.DataFrame:
+    """
+    Same result as numpy_ragged_groupby, computed by num_shards worker
+    processes, one per CPU by default. Pass an executor to reuse its
+    processes across calls. Like the default one it should use the "spawn"
+    start method, as polars and numba thread pools do not survive a fork
+    """
+    categories, years, x_values, y_values = groupby_columns(df)
+    num_shards = num_shards or os.cpu_count() or 1
+    query_points = _query_points(interpolate_at)
+
+    group_codes, group_uniques = encode_keys((categories, years))
+    shard_ids = _shard_ids(group_codes, num_shards)
+    # Stable, so rows keep their input order within a shard
+    row_order = argsort_packed(shard_ids, num_shards)
+    shard_sizes = np.bincount(shard_ids.astype(np.int64), minlength=num_shards)
+    row_offsets: np.ndarray = np.concatenate(
+        (np.zeros(1, np.int64), np.cumsum(shard_sizes))
+    )
+
+    # Groups present in the input, in (category, year) order, grouped by
+    # shard as the workers write them, and the slice of the output each
+    # shard writes to
+    is_present = np.bincount(
+        group_codes.astype(np.int64), minlength=key_space_size(group_uniques)
+    ).astype(bool)
+    present_codes = np.flatnonzero(is_present).astype(np.uint64)
+    present_shards = _shard_ids(present_codes, num_shards)
+    group_order = argsort_packed(present_shards, num_shards)
+    shard_groups = np.bincount(present_shards.astype(np.int64), minlength=num_shards)
+    output_offsets: np.ndarray = np.concatenate(
+        (np.zeros(1, np.int64), np.cumsum(shard_groups))
+    ) * len(query_points)
+    group_categories, group_years = decode_keys(present_codes, group_uniques)
+
+    with ExitStack() as stack:
+        columns = {}
+        for name, values in zip(_COLUMNS, (categories, years, x_values, y_values)):
+            handle, shared_values = SharedArray.create(stack, values.dtype, len(values))
+            np.take(values, row_order, out=shared_values)
+            columns[name] = handle
+        output, output_values = SharedArray.create(
+            stack, np.dtype(np.float64), int(output_offsets[-1])
+        )
+
+        if executor is None:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    num_shards, mp_context=multiprocessing.get_context("spawn")
+                )
+            )
+        futures = [
+            executor.submit(
+                _interpolate_shard,
+                columns,
+                output,
+                (int(row_offsets[shard]), int(row_offsets[shard + 1])),
+                (int(output_offsets[shard]), int(output_offsets[shard + 1])),
+                query_points,
+            )
+            for shard in range(num_shards)
+            if row_offsets[shard + 1] > row_offsets[shard]
+        ]
+        for future in futures:
+            future.result()
+
+        # Back from shard order to (category, year) order
+        interpolated_y_values = np.empty((len(present_codes), len(query_points)))
+        interpolated_y_values[group_order] = output_values.reshape(
+            -1, len(query_points)
+        )
+        del output_values, shared_values
+
+    return _interpolated_frame(
+        group_categories,
+        group_years,
+        interpolate_at,
+        interpolated_y_values,
+    )
@@ -0,0 +1,118 @@
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from groupby_profile import _INTERPOLATE_AT, numpy_ragged_groupby
+
+_COLUMNS = ["category", "year", "x", "y"]
+_KEY_COLUMNS = ["category", "year"]
+_CHUNK_ROWS = 1_000_000
+_NUM_PARTITIONS = 64
+
+
+def parquet_chunks(
+    path: Union[str, Path], chunk_rows: int = _CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=_COLUMNS):
+        yield batch.to_pandas()
+
+
+def csv_chunks(
+    path: Union[str, Path], chunk_rows: int = _CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(path, usecols=_COLUMNS, chunksize=chunk_rows)
+
+
+def _sorted_streaming_groupby(
+    chunks: Iterable[pd.DataFrame], interpolate_at: Union[float, np.ndarray]
+) -> Iterator[pd.DataFrame]:
+    """
+    With input sorted by (category, year) every group in a chunk is complete
+    except possibly the last one, which is carried over to the next chunk
+    """
+    carry: Optional[pd.DataFrame] = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+
+        is_last_group = (chunk["category"] == chunk["category"].iat[-1]) & (
+            chunk["year"] == chunk["year"].iat[-1]
+        )
+        carry = chunk[is_last_group]
+        complete_groups = chunk[~is_last_group]
+        if len(complete_groups) > 0:
+            yield numpy_ragged_groupby(complete_groups, interpolate_at)
+
+    if carry is not None:
+        yield numpy_ragged_groupby(carry, interpolate_at)
+
+
+def _normalised_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    The chunk without rows missing a key or x, which every engine drops,
+    and with integral float keys as int64. csv_chunks reads a key column
+    with a missing value as float64, while the other chunks hold int64
+    """
+    chunk = chunk.dropna(subset=_KEY_COLUMNS + ["x"])
+    integral_keys = {
+        name: np.int64
+        for name in _KEY_COLUMNS
+        if np.issubdtype(chunk[name].dtype, np.floating)
+        and (np.mod(chunk[name].to_numpy(), 1) == 0).all()
+    }
+    return chunk.astype(integral_keys)
+
+
+def _partitioned_streaming_groupby(
+    chunks: Iterable[pd.DataFrame],
+    interpolate_at: Union[float, np.ndarray],
+    num_partitions: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    Unsorted input is hash partitioned on (category, year) and spilled to
+    Parquet, so that every group lands whole in one partition. Partitions
+    are then read back and grouped one at a time
+    """
+    with tempfile.TemporaryDirectory() as spill_dir:
+        for chunk_number, chunk in enumerate(chunks):
+            chunk = _normalised_chunk(chunk)
+            # The hash depends on the dtype as well as the value, so keys are
+            # hashed as float64 to send a group to one partition from any chunk
+            key_values = chunk[_KEY_COLUMNS].astype(np.float64)
+            partitions = (
+                pd.util.hash_pandas_object(key_values, index=False).to_numpy()
+                % num_partitions
+            )
+            for partition, partition_chunk in chunk.groupby(partitions):
+                partition_dir = Path(spill_dir) / f"partition={partition}"
+                partition_dir.mkdir(exist_ok=True)
+                partition_chunk.to_parquet(
+                    partition_dir / f"{chunk_number}.parquet", index=False
+                )
+
+        for partition_dir in sorted(Path(spill_dir).iterdir()):
+            yield numpy_ragged_groupby(pd.read_parquet(partition_dir), interpolate_at)
+
+
+def streaming_groupby(
+    chunks: Iterable[pd.DataFrame],
+    interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT,
+    is_sorted: bool = False,
+    num_partitions: int = _NUM_PARTITIONS,
+) -> Iterator[pd.DataFrame]:
+    """
+    Groupby-interpolate over a stream of chunks, e.g. from parquet_chunks
+    or csv_chunks, yielding results as groups complete. Peak memory is set
+    by the chunk size when the input is sorted by (category, year), and by
+    dataset size / num_partitions otherwise
+    """
+    if is_sorted:
+        return _sorted_streaming_groupby(chunks, interpolate_at)
+    return _partitioned_streaming_groupby(chunks, interpolate_at, num_partitions)
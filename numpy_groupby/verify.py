@@ -0,0 +1,280 @@
+"""
+Check the groupby-interpolate engines against a reference implementation.
+
+Every engine runs on generated and adversarial inputs (unsorted rows,
+duplicate x values, NaNs, single-row groups) for a scalar and a vector of
+query points. Rows with a NaN category, year or x belong to no group and
+every engine drops them, while a NaN y is interpolated like any value.
+Results are put in a canonical row and column order and compared with
+tolerances. Exits non-zero when any engine disagrees.
+
+    python verify.py --engines numpy numba polars_expr --rtol 1e-9
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from columns import ColumnSource, groupby_columns
+from compact import compact_columns
+from data_generator import generate_columns
+from group_index import indexed_groupby
+from groupby_profile import (
+    _INTERPOLATE_AT,
+    create_dataframe_data,
+    njit_numpy_groupby,
+    numpy_groupby,
+    numpy_ragged_groupby,
+    pandas_groupby,
+    polars_expr_groupby,
+    polars_groupby,
+    ragged_groupby,
+)
+from sharded_groupby import sharded_groupby
+
+_KEY_COLUMNS = ["category", "year"]
+_RTOL = 1e-9
+_ATOL = 1e-12
+_FLOAT32_RTOL = 1e-6
+# Query points inside, on and beyond the x range of every group
+_VECTOR_INTERPOLATE_AT = np.array([-0.5, 0.0, 0.1, 0.3, 0.75, 1.0, 1.5])
+
+
+@dataclass(frozen=True)
+class Engine:
+    groupby: Callable[..., Any]
+    to_input: Callable[[pd.DataFrame], Any] = lambda df: df
+    # numpy_groupby and njit_numpy_groupby reshape to one row per group,
+    # so they need every group to hold each x value exactly once
+    needs_grid: bool = False
+
+
+@dataclass(frozen=True)
+class VerifyCase:
+    name: str
+    df: pd.DataFrame
+    is_grid: bool = False
+    # Overrides --rtol, e.g. for float32 input whose rounding differs by engine
+    rtol: Optional[float] = None
+
+
+_ENGINES: Dict[str, Engine] = {
+    "pandas": Engine(pandas_groupby),
+    "numpy": Engine(numpy_groupby, needs_grid=True),
+    "numpy_ragged": Engine(numpy_ragged_groupby),
+    "numba": Engine(njit_numpy_groupby, needs_grid=True),
+    "numba_parallel": Engine(
+        partial(njit_numpy_groupby, parallel=True), needs_grid=True
+    ),
+    "numba_ragged": Engine(ragged_groupby),
+    "numba_ragged_parallel": Engine(partial(ragged_groupby, parallel=True)),
+    "indexed": Engine(indexed_groupby),
+    "sharded": Engine(partial(sharded_groupby, num_shards=3)),
+    "polars": Engine(polars_groupby, pl.from_pandas),
+    "polars_expr": Engine(polars_expr_groupby, pl.from_pandas),
+}
+
+
+def reference_groupby(
+    df: ColumnSource, interpolate_at: Union[float, np.ndarray] = _INTERPOLATE_AT
+) -> pd.DataFrame:
+    """
+    The slow, obviously correct answer: rows of each (category, year) are
+    stably sorted by x, keeping duplicate x values in input order, and
+    passed to np.interp one group at a time. The groupby drops NaN keys and
+    rows with a NaN x are skipped
+    """
+    categories, years, x_values, y_values = groupby_columns(df, drop_missing=False)
+    query_points = np.atleast_1d(np.asarray(interpolate_at, dtype=np.float64))
+
+    rows: Dict[str, List[Any]] = {"category": [], "year": [], "x": [], "y": []}
+    groups = pd.DataFrame({"category": categories, "year": years}).groupby(
+        _KEY_COLUMNS, sort=True
+    )
+    for (category, year), row_indices in groups.indices.items():
+        row_indices = row_indices[~np.isnan(x_values[row_indices])]
+        if len(row_indices) == 0:
+            continue
+        order = row_indices[np.argsort(x_values[row_indices], kind="stable")]
+        interpolated = np.interp(query_points, x_values[order], y_values[order])
+        rows["category"].extend([category] * len(query_points))
+        rows["year"].extend([year] * len(query_points))
+        rows["x"].extend(query_points)
+        rows["y"].extend(interpolated)
+
+    expected = pd.DataFrame(
+        {
+            "category": np.asarray(rows["category"], dtype=categories.dtype),
+            "year": np.asarray(rows["year"], dtype=years.dtype),
+            "x": np.asarray(rows["x"], dtype=np.float64),
+            "y": np.asarray(rows["y"], dtype=np.float64),
+        }
+    )
+    if np.ndim(interpolate_at) == 0:
+        return expected.drop(columns="x")
+    return expected
+
+
+def canonical_frame(result: Union[pd.DataFrame, pl.DataFrame]) -> pd.DataFrame:
+    """
+    Engine output as pandas with columns (category, year, [x,] y), sorted
+    by its keys and with int64/float64 dtypes, so frames from any engine
+    can be compared row by row
+    """
+    if isinstance(result, pl.DataFrame):
+        result = result.to_pandas()
+
+    key_columns = _KEY_COLUMNS + (["x"] if "x" in result.columns else [])
+    return (
+        result[key_columns + ["y"]]
+        .astype({"category": np.int64, "year": np.int64})
+        .astype({column: np.float64 for column in key_columns[2:] + ["y"]})
+        .sort_values(key_columns, kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def compare_frames(
+    result: pd.DataFrame,
+    expected: pd.DataFrame,
+    rtol: float = _RTOL,
+    atol: float = _ATOL,
+) -> Optional[str]:
+    """
+    None when both frames hold the same groups and y agrees within
+    rtol/atol, with NaN equal to NaN. Otherwise a description of the
+    first difference
+    """
+    result, expected = canonical_frame(result), canonical_frame(expected)
+    if list(result.columns) != list(expected.columns):
+        return f"columns {list(result.columns)} != {list(expected.columns)}"
+    if len(result) != len(expected):
+        return f"{len(result)} rows != {len(expected)} rows"
+
+    key_columns = list(expected.columns[:-1])
+    if not result[key_columns].equals(expected[key_columns]):
+        return "group keys differ"
+
+    is_close = np.isclose(
+        result["y"], expected["y"], rtol=rtol, atol=atol, equal_nan=True
+    )
+    if is_close.all():
+        return None
+
+    mismatches = np.flatnonzero(~is_close)
+    first = mismatches[0]
+    return (
+        f"{len(mismatches)} of {len(expected)} values differ, first at "
+        f"{dict(expected.loc[first, key_columns])}: "
+        f"{result.at[first, 'y']!r} != {expected.at[first, 'y']!r}"
+    )
+
+
+def verify_cases(seed: int = 0) -> List[VerifyCase]:
+    rng = np.random.default_rng(seed)
+
+    grid = pd.DataFrame(create_dataframe_data())
+    ragged = pd.DataFrame(
+        generate_columns(5_000, num_categories=4, skew=1.5, seed=seed)
+    )
+
+    duplicate_x = pd.DataFrame(
+        generate_columns(5_000, num_categories=4, num_x_values=7, seed=seed)
+    )
+
+    single_rows = ragged.drop_duplicates(_KEY_COLUMNS).reset_index(drop=True)
+
+    nan_y = ragged.copy()
+    nan_y.loc[rng.random(len(nan_y)) < 0.01, "y"] = np.nan
+
+    nan_x = ragged.copy()
+    nan_x.loc[rng.random(len(nan_x)) < 0.01, "x"] = np.nan
+    # A group whose rows all have a NaN x disappears from the result
+    nan_x.loc[nan_x["category"] == nan_x["category"].iat[0], "x"] = np.nan
+
+    nan_keys = ragged.astype({"category": np.float64, "year": np.float64})
+    nan_keys.loc[rng.random(len(nan_keys)) < 0.01, "category"] = np.nan
+    nan_keys.loc[rng.random(len(nan_keys)) < 0.01, "year"] = np.nan
+
+    return [
+        VerifyCase("grid", grid, is_grid=True),
+        VerifyCase(
+            "grid_shuffled",
+            grid.sample(frac=1, random_state=seed).reset_index(drop=True),
+            is_grid=True,
+        ),
+        VerifyCase("ragged_skewed", ragged),
+        VerifyCase("duplicate_x", duplicate_x),
+        VerifyCase("single_row_groups", single_rows),
+        VerifyCase("mixed_group_sizes", pd.concat([single_rows, ragged])),
+        VerifyCase("nan_y", nan_y),
+        VerifyCase("nan_x", nan_x),
+        VerifyCase("nan_keys", nan_keys),
+        VerifyCase(
+            "compact_float32",
+            pd.DataFrame(compact_columns(ragged, "float32")),
+            rtol=_FLOAT32_RTOL,
+        ),
+    ]
+
+
+def verify(
+    engine_names: List[str],
+    cases: List[VerifyCase],
+    rtol: float = _RTOL,
+    atol: float = _ATOL,
+) -> List[str]:
+    """
+    Run every engine on every case it supports, for a scalar and a vector
+    of query points, and return a description of each disagreement with
+    reference_groupby
+    """
+    query_sets: Tuple[Union[float, np.ndarray], ...] = (
+        _INTERPOLATE_AT,
+        _VECTOR_INTERPOLATE_AT,
+    )
+    failures = []
+    for case in cases:
+        for interpolate_at in query_sets:
+            expected = reference_groupby(case.df, interpolate_at)
+            for engine_name in engine_names:
+                engine = _ENGINES[engine_name]
+                if engine.needs_grid and not case.is_grid:
+                    continue
+
+                label = f"{engine_name} on {case.name} at {interpolate_at}"
+                try:
+                    result = engine.groupby(engine.to_input(case.df), interpolate_at)
+                except Exception as error:
+                    failures.append(f"{label}: raised {error!r}")
+                    continue
+
+                difference = compare_frames(result, expected, case.rtol or rtol, atol)
+                if difference is not None:
+                    failures.append(f"{label}: {difference}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--engines", nargs="+", default=list(_ENGINES), choices=list(_ENGINES)
+    )
+    parser.add_argument("--rtol", type=float, default=_RTOL)
+    parser.add_argument("--atol", type=float, default=_ATOL)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cases = verify_cases(args.seed)
+    failures = verify(args.engines, cases, args.rtol, args.atol)
+    for failure in failures:
+        print(f"MISMATCH: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"All engines agree with the reference on {len(cases)} cases")
@@ -0,0 +1,74 @@
+import time
+from typing import List, Tuple
+
+import numba as nb
+
+from groupby_profile import (
+    _groupby_interpolate,
+    _njit_segment_offsets,
+    _parallel_groupby_interpolate,
+    _parallel_ragged_groupby_interpolate,
+    _ragged_groupby_interpolate,
+    _sort_rows,
+    _sort_segments,
+)
+from key_encoding import counting_argsort, njit_argsort_packed
+from segment_reduce import _segment_argmax, _segment_percentiles
+
+# The dtypes our groupby jobs see: packed uint64 keys, int64 sizes
+# and float64 x and y columns coming out of to_numpy()
+_PACKED_KEYS = nb.uint64[::1]
+_VALUES = nb.float64[::1]
+# Memory mapped and Arrow backed columns come in read only
+_READONLY_VALUES = nb.types.Array(nb.float64, 1, "C", readonly=True)
+# Compact columns from compact.compact_columns(..., float_dtype="float32")
+_COMPACT_VALUES = nb.float32[::1]
+_ROWS = nb.float64[:, ::1]
+_OFFSETS = nb.int64[::1]
+
+_KERNEL_SIGNATURES: List[Tuple[nb.core.dispatcher.Dispatcher, tuple]] = [
+    (counting_argsort, (_PACKED_KEYS, nb.int64)),
+    (njit_argsort_packed, (_PACKED_KEYS, nb.int64)),
+    (_njit_segment_offsets, (_PACKED_KEYS,)),
+    (_sort_rows, (_PACKED_KEYS, nb.int64, _VALUES, _VALUES)),
+    (_sort_rows, (_PACKED_KEYS, nb.int64, _READONLY_VALUES, _READONLY_VALUES)),
+    (_groupby_interpolate, (_VALUES, _ROWS, _VALUES)),
+    (_parallel_groupby_interpolate, (_VALUES, _ROWS, _VALUES)),
+    (_sort_segments, (_PACKED_KEYS, nb.int64, nb.uint64, _VALUES, _VALUES)),
+    (
+        _sort_segments,
+        (_PACKED_KEYS, nb.int64, nb.uint64, _READONLY_VALUES, _READONLY_VALUES),
+    ),
+    (
+        _sort_segments,
+        (_PACKED_KEYS, nb.int64, nb.uint64, _COMPACT_VALUES, _COMPACT_VALUES),
+    ),
+    (_ragged_groupby_interpolate, (_OFFSETS, _VALUES, _VALUES, _VALUES)),
+    (
+        _ragged_groupby_interpolate,
+        (_OFFSETS, _COMPACT_VALUES, _COMPACT_VALUES, _VALUES),
+    ),
+    (_parallel_ragged_groupby_interpolate, (_OFFSETS, _VALUES, _VALUES, _VALUES)),
+    (_segment_argmax, (_OFFSETS, _VALUES)),
+    (_segment_percentiles, (_OFFSETS, _VALUES, _VALUES)),
+]
+
+
+def warmup() -> float:
+    """
+    Compile every groupby kernel for the signatures we use. All kernels
+    are cache=True, so running this once at deploy time fills the on-disk
+    cache and later processes only load the compiled code
+    """
+    start = time.perf_counter()
+    for kernel, signature in _KERNEL_SIGNATURES:
+        kernel.compile(signature)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    """
+    Run at deploy time, e.g. `python warmup.py`, so that short-lived jobs
+    do not pay the first call compilation seen in groupby_profile
+    """
+    print(f"Compiled groupby kernels in {warmup():.2f}s")
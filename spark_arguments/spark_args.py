@@ -1,36 +1,102 @@
+import argparse
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass
 from functools import partial
-import random
-from typing import Tuple
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pyspark.sql.functions as F
 import pyspark.sql.types as T
-from pyspark.sql import SparkSession
+from pyspark.broadcast import Broadcast
+from pyspark.sql import DataFrame, SparkSession
 
 _CATEGORIES = [0, 1, 2]  # ["red", "green", "blue"]
 _YEARS = range(2010, 2021)
 _X_VALUES = [0, 0.1, 0.25, 0.5, 1.0]
 _INTERPOLATE_AT = 0.3
 
+_INTERPOLATED_SCHEMA = T.StructType(
+    [
+        T.StructField("category", T.ShortType(), True),
+        T.StructField("year", T.ShortType(), True),
+        T.StructField("interpolated_value", T.FloatType(), True),
+    ]
+)
+# Arrow types of _INTERPOLATED_SCHEMA, which mapInArrow batches must match
+_INTERPOLATED_ARROW_SCHEMA = pa.schema(
+    [("category", pa.int16()), ("year", pa.int16()), ("interpolated_value", pa.float32())]
+)
+_GRID_INTERPOLATED_SCHEMA = T.StructType(
+    [
+        T.StructField("category", T.ShortType(), True),
+        T.StructField("year", T.ShortType(), True),
+        T.StructField("x", T.FloatType(), True),
+        T.StructField("interpolated_value", T.FloatType(), True),
+    ]
+)
+_GRID_INTERPOLATED_ARROW_SCHEMA = pa.schema(
+    [("category", pa.int16()), ("year", pa.int16()), ("x", pa.float32()), ("interpolated_value", pa.float32())]
+)
 
-def _create_dataframe_data() -> pd.DataFrame:
-    columns = ["category", "year", "x", "y"]
-    data = []
-    for category in _CATEGORIES:
-        for year in _YEARS:
-            for x in _X_VALUES:
-                y = 25.0 * x + random.uniform(0, 1)
-                data.append([category, year, x, y])
-    return data, columns
+
+def _create_dataframe_data(seed: Optional[int] = 0) -> Dict[str, np.ndarray]:
+    """
+    Every (category, year, x) combination, built by broadcasting
+    instead of nested loops
+    """
+    rng = np.random.default_rng(seed)
+    category_grid, year_grid, x_grid = np.meshgrid(
+        np.asarray(_CATEGORIES), np.asarray(_YEARS), np.asarray(_X_VALUES), indexing="ij"
+    )
+    x_values = x_grid.ravel()
+    return {
+        "category": category_grid.ravel(),
+        "year": year_grid.ravel(),
+        "x": x_values,
+        "y": 25.0 * x_values + rng.uniform(0, 1, len(x_values)),
+    }
 
 
 def create_dataframe_pd() -> pd.DataFrame:
-    data, columns = _create_dataframe_data()
-    return pd.DataFrame(data, columns=columns)
+    return pd.DataFrame(_create_dataframe_data())
+
+
+def _create_benchmark_data(num_rows: int, num_groups: int, seed: Optional[int] = 0) -> pd.DataFrame:
+    """
+    num_rows random rows spread over num_groups (category, year) groups,
+    so the rows per group can be made small enough to expose per-group overhead
+    """
+    rng = np.random.default_rng(seed)
+    groups = rng.integers(0, num_groups, num_rows)
+    x_values = rng.random(num_rows)
+    return pd.DataFrame(
+        {
+            "category": groups // len(_YEARS),
+            "year": _YEARS[0] + groups % len(_YEARS),
+            "x": x_values,
+            "y": 25.0 * x_values + rng.uniform(0, 1, num_rows),
+        }
+    )
 
 
 def numpy_interpolate_global_args(indices: Tuple[int, int], df: pd.DataFrame) -> pd.DataFrame:
+    # np.interp needs increasing x, which a shuffle does not preserve
+    df = df.sort_values("x", kind="stable")
     interpolated_value = np.interp(_INTERPOLATE_AT, df["x"], df["y"])
 
     return pd.DataFrame(
@@ -44,6 +110,8 @@ def numpy_interpolate_global_args(indices: Tuple[int, int], df: pd.DataFrame) ->
 
 
 def numpy_interpolate_local_args(indices: Tuple[int, int], df: pd.DataFrame, interpolate_at: float) -> pd.DataFrame:
+    # np.interp needs increasing x, which a shuffle does not preserve
+    df = df.sort_values("x", kind="stable")
     interpolated_value = np.interp(interpolate_at, df["x"], df["y"])
 
     return pd.DataFrame(
@@ -56,36 +124,410 @@ def numpy_interpolate_local_args(indices: Tuple[int, int], df: pd.DataFrame, int
     )
 
 
-def _spark_session() -> SparkSession:
+def _sort_groups(
+    categories: np.ndarray, years: np.ndarray, x_values: np.ndarray, y_values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The rows sorted by (category, year, x), and the start and end row of every group
+    """
+    order = np.lexsort((x_values, years, categories))
+    categories, years, x_values, y_values = categories[order], years[order], x_values[order], y_values[order]
+
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = (categories[1:] != categories[:-1]) | (years[1:] != years[:-1])
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(order))
+    return categories, years, x_values, y_values, starts, ends
+
+
+def _interpolate_sorted(
+    x_values: np.ndarray,
+    y_values: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    query_groups: np.ndarray,
+    query_points: np.ndarray,
+) -> np.ndarray:
+    """
+    np.interp(query_points[i], x, y) within group query_groups[i] for every
+    query at once, with rows sorted by (group, x)
+    """
+    # Ranking x and the queries together turns (group, x) into one sorted
+    # integer key, so a single searchsorted finds every bracketing row
+    _, ranks = np.unique(np.concatenate((x_values, query_points)), return_inverse=True)
+    num_ranks = len(ranks)
+    num_rows = len(x_values)
+    row_keys = np.repeat(np.arange(len(starts)), ends - starts) * num_ranks + ranks[:num_rows]
+    query_keys = query_groups * num_ranks + ranks[num_rows:]
+
+    group_starts, group_ends = starts[query_groups], ends[query_groups]
+    upper = np.searchsorted(row_keys, query_keys, side="right")
+    upper = np.minimum(np.maximum(upper, group_starts + 1), group_ends - 1)
+    lower = np.maximum(upper - 1, group_starts)
+
+    x_lower, x_upper, y_lower, y_upper = x_values[lower], x_values[upper], y_values[lower], y_values[upper]
+    # Clipped weights give np.interp's constant extrapolation, and exact
+    # hits return the row itself like np.interp does
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(
+            x_upper > x_lower,
+            (query_points - x_lower) / (x_upper - x_lower),
+            np.where(query_points >= x_upper, 1.0, 0.0),
+        )
+        weights = np.clip(weights, 0.0, 1.0)
+        return np.where(
+            weights == 0.0, y_lower, np.where(weights == 1.0, y_upper, y_lower + weights * (y_upper - y_lower))
+        )
+
+
+def _segment_interpolate(
+    categories: np.ndarray, years: np.ndarray, x_values: np.ndarray, y_values: np.ndarray, interpolate_at: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    np.interp(interpolate_at, x, y) for every (category, year) group at once
+    """
+    categories, years, x_values, y_values, starts, ends = _sort_groups(categories, years, x_values, y_values)
+    interpolated = _interpolate_sorted(
+        x_values, y_values, starts, ends, np.arange(len(starts)), np.full(len(starts), float(interpolate_at))
+    )
+    return categories[starts], years[starts], interpolated
+
+
+def _table_columns(
+    batches: Iterator[pa.RecordBatch],
+) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    The category, year, x and y columns of a partition's batches combined,
+    since a group can span batches. None for an empty partition
+    """
+    non_empty_batches = [batch for batch in batches if batch.num_rows > 0]
+    if not non_empty_batches:
+        return None
+    table = pa.Table.from_batches(non_empty_batches)
+    categories, years, x_values, y_values = (table.column(name).to_numpy() for name in ["category", "year", "x", "y"])
+    return categories, years, x_values, y_values
+
+
+def arrow_interpolate_batches(
+    batches: Iterator[pa.RecordBatch], interpolate_at: float = _INTERPOLATE_AT
+) -> Iterator[pa.RecordBatch]:
+    """
+    mapInArrow function interpolating every group of a partition in one
+    vectorized call. The partition's batches are combined first, since a
+    group can span batches, and one batch with a row per group is returned
+    """
+    columns = _table_columns(batches)
+    if columns is None:
+        return
+
+    categories, years, interpolated = _segment_interpolate(*columns, interpolate_at)
+    yield pa.RecordBatch.from_arrays(
+        [
+            pa.array(categories.astype(np.int16)),
+            pa.array(years.astype(np.int16)),
+            pa.array(interpolated.astype(np.float32)),
+        ],
+        schema=_INTERPOLATED_ARROW_SCHEMA,
+    )
+
+
+def arrow_groupby_interpolate(spark_df: DataFrame, interpolate_at: float = _INTERPOLATE_AT) -> DataFrame:
+    """
+    Same result as groupBy().applyInPandas(numpy_interpolate_local_args)
+    without a pandas DataFrame per group. Repartitioning on the keys puts
+    every group whole into one partition, which mapInArrow gets as a stream
+    of Arrow record batches
+    """
+    return spark_df.repartition("category", "year").mapInArrow(
+        partial(arrow_interpolate_batches, interpolate_at=interpolate_at), schema=_INTERPOLATED_SCHEMA
+    )
+
+
+@dataclass(frozen=True)
+class InterpolationParameters:
+    """
+    A query grid per category, with an additive calibration for every query
+    point. The grids are stored back to back in flat arrays, category i's
+    spanning offsets[i]:offsets[i + 1], so they pickle as a few buffers
+    """
+
+    categories: np.ndarray
+    offsets: np.ndarray
+    query_points: np.ndarray
+    calibration: np.ndarray
+
+    @classmethod
+    def from_grids(
+        cls,
+        query_grids: Mapping[int, Union[Sequence[float], np.ndarray]],
+        calibration: Optional[Mapping[int, Union[Sequence[float], np.ndarray]]] = None,
+    ) -> "InterpolationParameters":
+        categories = np.array(sorted(query_grids), dtype=np.int64)
+        grids = [np.asarray(query_grids[category], dtype=np.float64) for category in categories]
+        calibrations = [
+            np.zeros(len(grid)) if calibration is None else np.asarray(calibration[category], dtype=np.float64)
+            for category, grid in zip(categories, grids)
+        ]
+        if any(len(grid) != len(values) for grid, values in zip(grids, calibrations)):
+            raise ValueError("Every calibration needs one value per query point of its category")
+
+        return cls(
+            categories,
+            np.concatenate((np.zeros(1, np.int64), np.cumsum([len(grid) for grid in grids], dtype=np.int64))),
+            np.concatenate(grids) if grids else np.zeros(0),
+            np.concatenate(calibrations) if calibrations else np.zeros(0),
+        )
+
+    def queries(self, group_categories: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Every query of the given groups: the group it belongs to, its x and
+        its calibration. Groups whose category has no grid get no queries
+        """
+        positions = np.minimum(np.searchsorted(self.categories, group_categories), len(self.categories) - 1)
+        has_grid = (
+            self.categories[positions] == group_categories
+            if len(self.categories)
+            else np.zeros(len(group_categories), dtype=bool)
+        )
+        grid_starts = self.offsets[positions]
+        grid_sizes = np.where(has_grid, self.offsets[positions + 1] - grid_starts, 0)
+
+        query_groups = np.repeat(np.arange(len(group_categories)), grid_sizes)
+        # Position of every query within its group's grid
+        query_ranks = np.arange(len(query_groups)) - np.repeat(np.cumsum(grid_sizes) - grid_sizes, grid_sizes)
+        query_indices = np.repeat(grid_starts, grid_sizes) + query_ranks
+        return query_groups, self.query_points[query_indices], self.calibration[query_indices]
+
+
+def broadcast_parameters(spark_session: SparkSession, parameters: InterpolationParameters) -> Broadcast:
+    """
+    Ship the parameters to every executor once. A closure would pickle them
+    into every task instead, while a broadcast is fetched once per executor
+    and, with Python worker reuse, loaded once per Python worker
+    """
+    return spark_session.sparkContext.broadcast(parameters)
+
+
+def arrow_interpolate_grid_batches(
+    batches: Iterator[pa.RecordBatch], parameters: Broadcast
+) -> Iterator[pa.RecordBatch]:
+    """
+    mapInArrow function interpolating every group of a partition at the
+    query grid of its category, looked up in the broadcast parameters
+    """
+    columns = _table_columns(batches)
+    if columns is None:
+        return
+
+    categories, years, x_values, y_values, starts, ends = _sort_groups(*columns)
+    # Broadcast.value is only unpickled on first access in each Python worker
+    query_groups, query_points, calibration = parameters.value.queries(categories[starts])
+    interpolated = _interpolate_sorted(x_values, y_values, starts, ends, query_groups, query_points) + calibration
+
+    yield pa.RecordBatch.from_arrays(
+        [
+            pa.array(categories[starts][query_groups].astype(np.int16)),
+            pa.array(years[starts][query_groups].astype(np.int16)),
+            pa.array(query_points.astype(np.float32)),
+            pa.array(interpolated.astype(np.float32)),
+        ],
+        schema=_GRID_INTERPOLATED_ARROW_SCHEMA,
+    )
+
+
+def arrow_groupby_interpolate_grid(spark_df: DataFrame, parameters: Broadcast) -> DataFrame:
+    """
+    One row per (category, year, query x), with the query grids of
+    broadcast_parameters. Only the broadcast's id is captured by the function
+    """
+    return spark_df.repartition("category", "year").mapInArrow(
+        partial(arrow_interpolate_grid_batches, parameters=parameters), schema=_GRID_INTERPOLATED_SCHEMA
+    )
+
+
+@dataclass(frozen=True)
+class SparkProfile:
+    """
+    Execution settings for the groupby-interpolate jobs. shuffle_partitions=None
+    sizes the groupBy shuffle from the data with partitions_for
+    """
+
+    master: str = "local[*]"
+    shuffle_partitions: Optional[int] = None
+    rows_per_partition: int = 1_000_000
+    adaptive: bool = True
+    # Lets AQE merge small shuffle partitions, off when measuring a fixed count
+    coalesce_partitions: bool = True
+    # AQE only splits skewed partitions of sort-merge joins, so this has no
+    # effect on the groupBy jobs here, whose skewed groups stay in one task
+    skew_join: bool = True
+    advisory_partition_size: str = "64m"
+    arrow_batch_size: int = 10_000
+
+    @property
+    def num_cores(self) -> int:
+        if not self.master.startswith("local["):
+            return 1
+        # local[N], local[*] or local[N,F] with F allowed task failures
+        cores = self.master.split("[")[1].rstrip("]").split(",")[0]
+        return (os.cpu_count() or 1) if cores == "*" else int(cores)
+
+    def partitions_for(self, num_rows: int) -> int:
+        """
+        Enough partitions for rows_per_partition rows each, rounded up to a
+        multiple of the cores so that the last wave of tasks keeps all of them busy
+        """
+        if self.shuffle_partitions is not None:
+            return self.shuffle_partitions
+        num_partitions = max(math.ceil(num_rows / self.rows_per_partition), 1)
+        return math.ceil(num_partitions / self.num_cores) * self.num_cores
+
+
+def _spark_session(profile: SparkProfile = SparkProfile(), num_rows: int = 0) -> SparkSession:
+    # spark.default.parallelism is left to Spark, which uses the cores of local[N]
+    num_partitions = str(profile.partitions_for(num_rows))
     return (
-        SparkSession.builder.master("local")
+        SparkSession.builder.master(profile.master)
         .appName("spark-args")
-        .config("spark.sql.shuffle.partitions", "1")
-        .config("spark.default.parallelism", "1")
+        .config("spark.sql.shuffle.partitions", num_partitions)
+        .config("spark.sql.adaptive.enabled", str(profile.adaptive).lower())
+        .config("spark.sql.adaptive.coalescePartitions.enabled", str(profile.coalesce_partitions).lower())
+        .config("spark.sql.adaptive.skewJoin.enabled", str(profile.skew_join).lower())
+        .config("spark.sql.adaptive.advisoryPartitionSizeInBytes", profile.advisory_partition_size)
+        # Keeps broadcast values loaded in the Python workers across tasks
+        .config("spark.python.worker.reuse", "true")
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .config("spark.sql.execution.arrow.maxRecordsPerBatch", str(profile.arrow_batch_size))
         .getOrCreate()
     )
 
 
+def set_shuffle_partitions(spark_session: SparkSession, profile: SparkProfile, num_rows: int) -> int:
+    """
+    Resize the groupBy shuffle of a running session for num_rows of input
+    """
+    num_partitions = profile.partitions_for(num_rows)
+    spark_session.conf.set("spark.sql.shuffle.partitions", str(num_partitions))
+    return num_partitions
+
+
+def _time_spark_job(spark_df: DataFrame, repeat: int = 5) -> List[float]:
+    # The noop sink runs the whole job without collecting rows to the driver
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        spark_df.write.format("noop").mode("overwrite").save()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _apply_in_pandas_groupby(spark_df: DataFrame) -> DataFrame:
+    numpy_groupby_interpolate_at = partial(numpy_interpolate_local_args, interpolate_at=_INTERPOLATE_AT)
+    return spark_df.groupBy(F.col("category"), F.col("year")).applyInPandas(
+        numpy_groupby_interpolate_at, schema=_INTERPOLATED_SCHEMA
+    )
+
+
+_GROUPBY_JOBS: Dict[str, Callable[[DataFrame], DataFrame]] = {
+    "applyInPandas": _apply_in_pandas_groupby,
+    "mapInArrow": arrow_groupby_interpolate,
+}
+
+
+def _benchmark(spark_session: SparkSession, num_rows: int, num_groups: int) -> None:
+    spark_df = spark_session.createDataFrame(_create_benchmark_data(num_rows, num_groups)).cache()
+    spark_df.count()
+
+    medians = {name: np.median(_time_spark_job(job(spark_df))) for name, job in _GROUPBY_JOBS.items()}
+    print(
+        f"{num_rows:,} rows in {num_groups:,} groups: "
+        + ", ".join(f"{name} median {median:.3f}s" for name, median in medians.items())
+    )
+    spark_df.unpersist()
+
+
+def _scaling_benchmark(
+    cores: Sequence[int], partitions: Sequence[int], rows: Sequence[int], rows_per_group: int, repeat: int
+) -> None:
+    """
+    Time both groupby jobs for every local[N], shuffle partition count and
+    data size. AQE coalescing is off so that each run uses the partition
+    count it is labelled with
+    """
+    for num_cores in cores:
+        profile = SparkProfile(master=f"local[{num_cores}]", coalesce_partitions=False)
+        spark_session = _spark_session(profile)
+        for num_rows in rows:
+            num_groups = max(num_rows // rows_per_group, 1)
+            spark_df = spark_session.createDataFrame(_create_benchmark_data(num_rows, num_groups)).cache()
+            spark_df.count()
+            for num_partitions in partitions:
+                spark_session.conf.set("spark.sql.shuffle.partitions", str(num_partitions))
+                for name, job in _GROUPBY_JOBS.items():
+                    median = np.median(_time_spark_job(job(spark_df), repeat))
+                    print(
+                        f"local[{num_cores}] partitions={num_partitions:<4} rows={num_rows:<11,} "
+                        f"{name:>13}: {median:.3f}s, {num_rows / median:,.0f} rows/s"
+                    )
+            spark_df.unpersist()
+        # local[N] is fixed for the lifetime of a SparkContext
+        spark_session.stop()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Spark groupby-interpolate with function arguments")
+    parser.add_argument("--master", default=SparkProfile.master)
+    parser.add_argument("--shuffle-partitions", type=int)
+    parser.add_argument("--arrow-batch-size", type=int, default=SparkProfile.arrow_batch_size)
+    parser.add_argument("--no-adaptive", action="store_true")
+    parser.add_argument(
+        "--scaling", action="store_true", help="Benchmark across --cores, --partitions and --rows instead"
+    )
+    parser.add_argument("--cores", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--partitions", nargs="+", type=int, default=[1, 4, 16, 64, 200])
+    parser.add_argument("--rows", nargs="+", type=float, default=[1e5, 1e6, 1e7])
+    parser.add_argument("--rows-per-group", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    spark_session = _spark_session()
-    spark_df = spark_session.createDataFrame(create_dataframe_pd())
+    args = _parse_args()
+    if args.scaling:
+        _scaling_benchmark(
+            args.cores, args.partitions, [int(num_rows) for num_rows in args.rows], args.rows_per_group, args.repeat
+        )
+        sys.exit()
 
-    interpolated_schema = T.StructType(
-        [
-            T.StructField("category", T.ShortType(), True),
-            T.StructField("year", T.ShortType(), True),
-            T.StructField("interpolated_value", T.FloatType(), True),
-        ]
+    profile = SparkProfile(
+        master=args.master,
+        shuffle_partitions=args.shuffle_partitions,
+        adaptive=not args.no_adaptive,
+        arrow_batch_size=args.arrow_batch_size,
     )
+    spark_session = _spark_session(profile)
+    spark_df = spark_session.createDataFrame(create_dataframe_pd())
     interpolated_df_global_args = spark_df.groupBy(F.col("category"), F.col("year")).applyInPandas(
-        numpy_interpolate_global_args, schema=interpolated_schema
+        numpy_interpolate_global_args, schema=_INTERPOLATED_SCHEMA
     )
 
     interpolated_df_global_args.show(truncate=False)
 
-    numpy_groupby_interpolate_at = partial(numpy_interpolate_local_args, interpolate_at=_INTERPOLATE_AT)
-    interpolated_df = spark_df.groupBy(F.col("category"), F.col("year")).applyInPandas(
-        numpy_groupby_interpolate_at, schema=interpolated_schema
-    )
+    interpolated_df = _apply_in_pandas_groupby(spark_df)
 
     interpolated_df.show(truncate=False)
+
+    arrow_groupby_interpolate(spark_df).show(truncate=False)
+
+    parameters = broadcast_parameters(
+        spark_session,
+        InterpolationParameters.from_grids(
+            {category: np.linspace(0, 1, 5 + category) for category in _CATEGORIES},
+            calibration={category: np.full(5 + category, 0.1 * category) for category in _CATEGORIES},
+        ),
+    )
+    arrow_groupby_interpolate_grid(spark_df, parameters).show(truncate=False)
+
+    for num_rows, num_groups in [(10**5, 10**3), (10**6, 10**4), (10**6, 10**5)]:
+        set_shuffle_partitions(spark_session, profile, num_rows)
+        _benchmark(spark_session, num_rows, num_groups)